@@ -1,123 +1,167 @@
-from typing import List, Dict
-import json
+from typing import List, Dict, Optional
 import os
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime, timedelta, timezone
 from collections import defaultdict, Counter
+from history_store import HistoryStore
+from columnar_analytics import ColumnarHistory
+from rollups import TimeSeriesRollups, RESOLUTIONS
+from violation_codes import VIOLATION_CODES, iter_bits, record_mask
+
+STATUS_SCORES = {"GREEN": 100, "YELLOW": 50, "RED": 0}
+
+# analysis_type comes from the client; anything else is recorded as "other" so it can't
+# create unbounded rollup cells, dashboard rows or (8-bit) columnar domain codes
+KNOWN_DOMAINS = ("general", "gdpr", "hipaa", "sox")
+OTHER_DOMAIN = "other"
+
+# Dashboard window -> (rollup resolution, how far back)
+DASHBOARD_WINDOWS = {
+    "1h": ("minute", timedelta(hours=1)),
+    "24h": ("hour", timedelta(hours=24)),
+    "7d": ("day", timedelta(days=7)),
+    "30d": ("day", timedelta(days=30))
+}
+
+class DashboardAggregates:
+    """Running counters plus per-day rollups, updated once per record"""
+
+    def __init__(self):
+        self.last_applied_id = 0
+        self.total = 0
+        self.latency_sum = 0.0
+        self.status_counts = Counter()
+        self.violation_counts = Counter()
+        self.code_counts = [0] * len(VIOLATION_CODES)  # indexed by violation code id
+        self.daily_scores = defaultdict(lambda: [0, 0])  # "YYYY-MM-DD" -> [score sum, count]
+        self.domain_stats = defaultdict(lambda: {"total": 0, "violations": 0})
+        self.rollups = TimeSeriesRollups()
+
+    def apply(self, record: Dict):
+        self.last_applied_id = max(self.last_applied_id, record.get("id", 0))
+        self.total += 1
+        self.latency_sum += record["latency_ms"]
+        self.status_counts[record["status"]] += 1
+        
+        violating = record["status"] in ["RED", "YELLOW"]
+        if violating:
+            self.violation_counts[record["violation_summary"]] += 1
+            for code_id in iter_bits(record_mask(record)):
+                self.code_counts[code_id] += 1
+        
+        # Local ISO timestamps sort and bucket by their date prefix, no parsing needed
+        day = self.daily_scores[record["timestamp"][:10]]
+        day[0] += STATUS_SCORES.get(record["status"], 0)
+        day[1] += 1
+        
+        domain = self.domain_stats[record["domain"]]
+        domain["total"] += 1
+        if violating:
+            domain["violations"] += 1
+        
+        self.rollups.add(record["timestamp"], record["domain"], record["status"], record["latency_ms"])
 
 class ComplianceAnalytics:
-    def __init__(self, data_file="compliance_history.json"):
-        self.data_file = data_file
-        self.history = self.load_history()
-
-    def load_history(self) -> List[Dict]:
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r') as f:
-                    return json.load(f)
-            except:
-                return []
-        return []
-
-    def save_analysis(self, analysis_result: Dict, input_text: str, domain: str):
+    def __init__(self, db_file=None, legacy_file="compliance_history.json"):
+        self.store = HistoryStore(db_file or os.getenv("ANALYTICS_DB_FILE", "compliance_history.db"))
+        # Older deployments kept everything in one JSON file; fold it in once
+        self.store.import_legacy_json(legacy_file)
+        self.aggregates_lock = threading.Lock()
+        self.aggregates = DashboardAggregates()
+        self.refresh_aggregates()
+        # Columnar copy for ad-hoc windows over millions of records
+        self.columns = ColumnarHistory(os.getenv("ANALYTICS_COLUMNS_DIR", "analytics_columns"))
+        self.columns.sync(self.store)
+
+    @property
+    def history(self) -> List[Dict]:
+        return list(self.store.iter_records())
+
+    def refresh_aggregates(self):
+        """Fold in records appended since the last refresh (by this or any other worker)"""
+        with self.aggregates_lock:
+            for record in self.store.iter_records(after_id=self.aggregates.last_applied_id):
+                self.aggregates.apply(record)
+
+    def rebuild_aggregates(self):
+        with self.aggregates_lock:
+            self.aggregates = DashboardAggregates()
+        self.refresh_aggregates()
+
+    def save_analysis(self, analysis_result: Dict, input_text: str, domain: str,
+                      latency_ms: Optional[float] = None) -> int:
+        """Append one analysis to the history and return its id (used for feedback).
+
+        latency_ms is the request's end-to-end latency, which the dashboard percentiles are
+        built from; it defaults to the analysis' own latency_ms.
+        """
         record = {
             "timestamp": datetime.now().isoformat(),
-            "domain": domain,
+            "domain": domain if domain in KNOWN_DOMAINS else OTHER_DOMAIN,
             "status": analysis_result["status"],
             "violation_summary": analysis_result["violation_summary"],
-            "evidence": analysis_result.get("evidence", []),
-            "latency_ms": analysis_result["latency_ms"],
+            "violation_mask": analysis_result.get("violation_mask", 0),
+            "keyword_mask": analysis_result.get("keyword_mask", 0),  # match index for /explain
+            "latency_ms": latency_ms if latency_ms is not None else analysis_result["latency_ms"],
             "input_length": len(input_text),
             "feedback": None  # Will be updated when user provides feedback
         }
         
-        self.history.append(record)
-        
-        # Keep only last 1000 records for demo
-        if len(self.history) > 1000:
-            self.history = self.history[-1000:]
-        
-        with open(self.data_file, 'w') as f:
-            json.dump(self.history, f, indent=2)
+        # Dashboards fold new records in when they are read; don't wait for the commit here
+        return self.store.append(record, durable=False)
 
-    def get_risk_dashboard_data(self) -> Dict:
-        if not self.history:
-            return self.get_mock_dashboard_data()
+    def get_analysis(self, analysis_id: int) -> Optional[Dict]:
+        return self.store.get(analysis_id)
 
-        # Status distribution
-        status_counts = Counter(record["status"] for record in self.history)
-        
-        # Top violations
-        violation_counts = Counter()
-        for record in self.history:
-            if record["status"] in ["RED", "YELLOW"]:
-                violation_counts[record["violation_summary"]] += 1
-        
-        # Compliance score over time (last 30 days)
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        recent_records = [
-            record for record in self.history 
-            if datetime.fromisoformat(record["timestamp"]) > thirty_days_ago
-        ]
-        
-        daily_scores = defaultdict(list)
-        for record in recent_records:
-            date = datetime.fromisoformat(record["timestamp"]).date()
-            score = 100 if record["status"] == "GREEN" else 50 if record["status"] == "YELLOW" else 0
-            daily_scores[date.isoformat()].append(score)
-        
-        # Average scores by day
-        avg_daily_scores = {
-            date: sum(scores) / len(scores) 
-            for date, scores in daily_scores.items()
-        }
+    def get_risk_dashboard_data(self) -> Dict:
+        self.refresh_aggregates()
+        with self.aggregates_lock:
+            aggregates = self.aggregates
+            
+            # Compliance score over time (last 30 days)
+            cutoff = (datetime.now() - timedelta(days=30)).date().isoformat()
+            avg_daily_scores = {
+                date: score_sum / count
+                for date, (score_sum, count) in aggregates.daily_scores.items()
+                if date >= cutoff
+            }
+            
+            return {
+                "status_distribution": dict(aggregates.status_counts),
+                "top_violations": dict(aggregates.violation_counts.most_common(5)),
+                "violation_codes": {
+                    code: count for code, count in zip(VIOLATION_CODES, aggregates.code_counts) if count
+                },
+                "compliance_trend": avg_daily_scores,
+                "domain_breakdown": {d: dict(stats) for d, stats in aggregates.domain_stats.items()},
+                "total_analyses": aggregates.total,
+                "avg_latency": aggregates.latency_sum / aggregates.total if aggregates.total else 0,
+                "latency_percentiles": self._window_locked("30d")["latency_percentiles"]
+            }
 
-        # Domain breakdown
-        domain_stats = defaultdict(lambda: {"total": 0, "violations": 0})
-        for record in self.history:
-            domain_stats[record["domain"]]["total"] += 1
-            if record["status"] in ["RED", "YELLOW"]:
-                domain_stats[record["domain"]]["violations"] += 1
+    def get_time_series(self, window: str = "24h", domain: Optional[str] = None) -> Dict:
+        """Counts and p50/p95/p99 latency for a recent window, overall and per domain"""
+        if window not in DASHBOARD_WINDOWS:
+            raise ValueError(f"Unknown window '{window}'. Available: {list(DASHBOARD_WINDOWS)}")
+        self.refresh_aggregates()
+        with self.aggregates_lock:
+            return {"window": window, **self._window_locked(window, domain)}
 
-        return {
-            "status_distribution": dict(status_counts),
-            "top_violations": dict(violation_counts.most_common(5)),
-            "compliance_trend": avg_daily_scores,
-            "domain_breakdown": dict(domain_stats),
-            "total_analyses": len(self.history),
-            "avg_latency": sum(r["latency_ms"] for r in self.history) / len(self.history) if self.history else 0
-        }
+    def _window_locked(self, window: str, domain: Optional[str] = None) -> Dict:
+        resolution, span = DASHBOARD_WINDOWS[window]
+        since_key = (datetime.now() - span).isoformat()[:RESOLUTIONS[resolution][0]]
+        return {"resolution": resolution, **self.aggregates.rollups.window(resolution, since_key, domain)}
 
-    def get_mock_dashboard_data(self) -> Dict:
-        return {
-            "status_distribution": {"GREEN": 45, "YELLOW": 23, "RED": 12},
-            "top_violations": {
-                "Missing consent mechanism": 8,
-                "Inadequate data encryption": 6,
-                "Insufficient access controls": 4,
-                "Missing audit trail": 3,
-                "Improper data retention": 2
-            },
-            "compliance_trend": {
-                "2024-01-15": 85.2,
-                "2024-01-16": 78.9,
-                "2024-01-17": 92.1,
-                "2024-01-18": 88.7,
-                "2024-01-19": 91.3
-            },
-            "domain_breakdown": {
-                "gdpr": {"total": 35, "violations": 8},
-                "hipaa": {"total": 25, "violations": 5},
-                "sox": {"total": 20, "violations": 2}
-            },
-            "total_analyses": 80,
-            "avg_latency": 245
-        }
+    def get_dashboard_window(self, days: Optional[int] = None, domain: Optional[str] = None) -> Dict:
+        """Dashboard aggregates for the last `days` days and/or one domain, computed column-wise"""
+        self.columns.sync(self.store)
+        since = None
+        if days is not None:
+            since = int((datetime.now() - timedelta(days=days)).replace(tzinfo=timezone.utc).timestamp())
+        return self.columns.dashboard(since=since, domain=domain)
 
-    def add_feedback(self, analysis_id: int, feedback: str):
-        if 0 <= analysis_id < len(self.history):
-            self.history[analysis_id]["feedback"] = feedback
-            with open(self.data_file, 'w') as f:
-                json.dump(self.history, f, indent=2)
+    def add_feedback(self, analysis_id: int, feedback: str) -> bool:
+        return self.store.update_feedback(analysis_id, feedback)
 
     def get_learning_insights(self) -> Dict:
         feedback_records = [r for r in self.history if r.get("feedback")]
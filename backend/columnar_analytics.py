@@ -0,0 +1,337 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from violation_codes import VIOLATION_CODES, code_counts, record_mask
+
+# One memory-mapped .npy file per column; "meta.json" holds the committed length and the
+# category dictionaries, and is only replaced after the column data is flushed
+COLUMNS = {
+    "id": np.int64,
+    "ts": np.int64,          # seconds since epoch of the (local, naive) analysis timestamp
+    "status": np.uint8,
+    "domain": np.uint8,
+    "violation": np.uint16,  # violation_summary, dictionary-encoded
+    "violation_mask": np.uint16,  # violation code bits (see violation_codes)
+    "latency_ms": np.float32
+}
+CATEGORICAL = ("status", "domain", "violation")
+STATUS_SCORES = {"GREEN": 100, "YELLOW": 50, "RED": 0}
+VIOLATING_STATUSES = ("RED", "YELLOW")
+OTHER_CATEGORY = "Other"
+SECONDS_PER_DAY = 86400
+# Bumped whenever the column set or cube key layout changes; older directories are rebuilt
+FORMAT_VERSION = 2
+
+# Daily cube cell key: day << 48 | domain << 40 | status << 32 | violation << 16 | violation mask.
+# Keys sort by day first, so a day range is a contiguous slice found with searchsorted.
+DAY_SHIFT, DOMAIN_SHIFT, STATUS_SHIFT, VIOLATION_SHIFT = 48, 40, 32, 16
+CUBE_FILES = ("cube_keys", "cube_counts", "cube_latency")
+
+def cube_key(day, domain, status, violation, violation_mask) -> np.ndarray:
+    return (
+        (np.asarray(day, dtype=np.int64) << DAY_SHIFT)
+        | (np.asarray(domain, dtype=np.int64) << DOMAIN_SHIFT)
+        | (np.asarray(status, dtype=np.int64) << STATUS_SHIFT)
+        | (np.asarray(violation, dtype=np.int64) << VIOLATION_SHIFT)
+        | np.asarray(violation_mask, dtype=np.int64)
+    )
+
+def empty_dashboard() -> Dict:
+    return {
+        "status_distribution": {}, "top_violations": {}, "violation_codes": {}, "compliance_trend": {},
+        "domain_breakdown": {}, "total_analyses": 0, "avg_latency": 0
+    }
+
+class ColumnarHistory:
+    """Columnar copy of the analysis history for vectorized dashboard queries.
+
+    Raw rows live in memory-mapped columns; alongside them a small daily cube (count and
+    latency sum per day/domain/status/violation/code-mask cell) is merged on every append, so
+    dashboards over whole days never touch the raw rows. The history store stays the source
+    of truth; sync() appends whatever it has that the columns don't. Several workers can
+    share one directory: appends happen under an exclusive file lock and readers re-map the
+    columns when meta.json changes.
+    """
+
+    def __init__(self, directory: str, initial_capacity: int = 1 << 16):
+        self.directory = directory
+        self.initial_capacity = initial_capacity
+        os.makedirs(directory, exist_ok=True)
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.lock_path = os.path.join(directory, ".lock")
+        self.meta_mtime = None
+        self.columns: Dict[str, np.ndarray] = {}
+        self._reload()
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.npy")
+
+    @contextmanager
+    def _exclusive(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload(self):
+        self.meta = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                self.meta = json.load(f)
+            self.meta_mtime = os.stat(self.meta_path).st_mtime_ns
+        if self.meta is None or self.meta.get("format") != FORMAT_VERSION:
+            # Missing or an older layout: start empty and let sync() rebuild from the store
+            self.meta = {"format": FORMAT_VERSION, "length": 0, "capacity": 0, "last_id": 0,
+                         "categories": {c: [] for c in CATEGORICAL}}
+        self.codes = {c: {value: code for code, value in enumerate(values)}
+                      for c, values in self.meta["categories"].items()}
+        self.columns = {}
+        if self.meta["capacity"]:
+            self.columns = {name: np.load(self._column_path(name), mmap_mode="r+") for name in COLUMNS}
+        if self.meta["length"]:
+            self.cube = tuple(np.load(self._column_path(name)) for name in CUBE_FILES)
+        else:
+            self.cube = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+
+    def _maybe_reload(self):
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self.meta_mtime:
+            self._reload()
+
+    def _grow(self, needed: int):
+        capacity = max(self.meta["capacity"], self.initial_capacity)
+        while capacity < needed:
+            capacity *= 2
+        length = self.meta["length"]
+        for name, dtype in COLUMNS.items():
+            tmp_path = self._column_path(name) + ".tmp"
+            grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(capacity,))
+            if length:
+                grown[:length] = self.columns[name][:length]
+            grown.flush()
+            del grown
+            os.replace(tmp_path, self._column_path(name))
+        self.meta["capacity"] = capacity
+        self.columns = {name: np.load(self._column_path(name), mmap_mode="r+") for name in COLUMNS}
+
+    def _encode(self, category: str, values: Iterable[str]) -> List[int]:
+        codes = self.codes[category]
+        names = self.meta["categories"][category]
+        limit = np.iinfo(COLUMNS[category]).max
+        encoded = []
+        for value in values:
+            code = codes.get(value)
+            if code is None:
+                if len(names) >= limit:
+                    # Dictionary full: lump the long tail together rather than fail
+                    value = OTHER_CATEGORY
+                    code = codes.get(value)
+                if code is None:
+                    code = len(names)
+                    names.append(value)
+                    codes[value] = code
+            encoded.append(code)
+        return encoded
+
+    def append(self, records: List[Dict]):
+        """Append records (each with an "id") that are newer than anything already stored"""
+        with self._exclusive():
+            self._maybe_reload()
+            records = [r for r in records if r["id"] > self.meta["last_id"]]
+            if not records:
+                return 0
+            self._append_locked(records)
+            return len(records)
+
+    def _append_locked(self, records: List[Dict]):
+        start = self.meta["length"]
+        end = start + len(records)
+        if end > self.meta["capacity"]:
+            self._grow(end)
+
+        columns = self.columns
+        columns["id"][start:end] = [r["id"] for r in records]
+        columns["ts"][start:end] = np.array(
+            [r["timestamp"] for r in records], dtype="datetime64[s]"
+        ).astype(np.int64)
+        columns["status"][start:end] = self._encode("status", (r["status"] for r in records))
+        columns["domain"][start:end] = self._encode("domain", (r["domain"] for r in records))
+        columns["violation"][start:end] = self._encode("violation", (r["violation_summary"] for r in records))
+        columns["violation_mask"][start:end] = [record_mask(r) for r in records]
+        columns["latency_ms"][start:end] = [r["latency_ms"] for r in records]
+        for column in columns.values():
+            column.flush()
+        self._merge_cube(start, end)
+
+        # Commit point: readers only ever see rows below the published length
+        self.meta["length"] = end
+        self.meta["last_id"] = int(records[-1]["id"])
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self.meta_mtime = os.stat(self.meta_path).st_mtime_ns
+
+    def _merge_cube(self, start: int, end: int):
+        columns = self.columns
+        keys = cube_key(
+            columns["ts"][start:end] // SECONDS_PER_DAY, columns["domain"][start:end],
+            columns["status"][start:end], columns["violation"][start:end], columns["violation_mask"][start:end]
+        )
+        # Collapse only the new rows into cells, then fold those into the sorted cube
+        new_keys, cells = np.unique(keys, return_inverse=True)
+        new_counts = np.bincount(cells, minlength=len(new_keys)).astype(np.int64)
+        new_latency = np.bincount(cells, weights=columns["latency_ms"][start:end], minlength=len(new_keys))
+
+        cube_keys, cube_counts, cube_latency = self.cube
+        positions = np.searchsorted(cube_keys, new_keys)
+        found = positions < len(cube_keys)
+        found[found] = cube_keys[positions[found]] == new_keys[found]
+        cube_counts[positions[found]] += new_counts[found]
+        cube_latency[positions[found]] += new_latency[found]
+        changed = CUBE_FILES[1:]
+        if not found.all():
+            # New cells: insert them at their sorted positions (the only case that copies the cube)
+            missing = ~found
+            at = positions[missing]
+            self.cube = (
+                np.insert(cube_keys, at, new_keys[missing]),
+                np.insert(cube_counts, at, new_counts[missing]),
+                np.insert(cube_latency, at, new_latency[missing])
+            )
+            changed = CUBE_FILES
+        for name, array in zip(CUBE_FILES, self.cube):
+            if name not in changed:
+                continue
+            tmp_path = self._column_path(name) + ".tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, self._column_path(name))
+
+    def sync(self, store, batch_size: int = 50000) -> int:
+        """Append everything the history store has beyond our last id"""
+        appended = 0
+        with self._exclusive():
+            self._maybe_reload()
+            batch = []
+            for record in store.iter_records(after_id=self.meta["last_id"]):
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    self._append_locked(batch)
+                    appended += len(batch)
+                    batch = []
+            if batch:
+                self._append_locked(batch)
+                appended += len(batch)
+        return appended
+
+    def __len__(self) -> int:
+        return self.meta["length"]
+
+    def dashboard(self, since: Optional[int] = None, until: Optional[int] = None,
+                  domain: Optional[str] = None, top_n: int = 5) -> Dict:
+        """Dashboard aggregates over [since, until) epoch seconds, optionally for one domain.
+
+        Whole days come from the daily cube; only the ragged edges of a window that doesn't
+        start or end on midnight are scanned in the raw columns.
+        """
+        self._maybe_reload()
+        length = self.meta["length"]
+        if not length:
+            return empty_dashboard()
+
+        cube_keys, cube_counts, cube_latency = self.cube
+        first_day = -(-since // SECONDS_PER_DAY) if since is not None else None
+        end_day = until // SECONDS_PER_DAY if until is not None else None
+        edges = []
+        if first_day is not None and end_day is not None and first_day >= end_day:
+            # Window within a single day (or spanning one midnight): raw rows only
+            lo = hi = 0
+            edges.append((since, until))
+        else:
+            lo = np.searchsorted(cube_keys, first_day << DAY_SHIFT) if first_day is not None else 0
+            hi = np.searchsorted(cube_keys, end_day << DAY_SHIFT) if end_day is not None else len(cube_keys)
+            if since is not None and since % SECONDS_PER_DAY:
+                edges.append((since, first_day * SECONDS_PER_DAY))
+            if until is not None and until % SECONDS_PER_DAY:
+                edges.append((end_day * SECONDS_PER_DAY, until))
+
+        keys, counts, latency = [cube_keys[lo:hi]], [cube_counts[lo:hi]], [cube_latency[lo:hi]]
+        if edges:
+            ts = self.columns["ts"][:length]
+            for start, end in edges:
+                rows = np.flatnonzero((ts >= start) & (ts < end))
+                keys.append(cube_key(
+                    ts[rows] // SECONDS_PER_DAY, self.columns["domain"][rows],
+                    self.columns["status"][rows], self.columns["violation"][rows],
+                    self.columns["violation_mask"][rows]
+                ))
+                counts.append(np.ones(len(rows), dtype=np.int64))
+                latency.append(self.columns["latency_ms"][rows].astype(np.float64))
+        keys, counts, latency = np.concatenate(keys), np.concatenate(counts), np.concatenate(latency)
+
+        if domain is not None:
+            code = self.codes["domain"].get(domain)
+            selected = (keys >> DOMAIN_SHIFT) & 0xFF == code if code is not None else np.zeros(len(keys), dtype=bool)
+            keys, counts, latency = keys[selected], counts[selected], latency[selected]
+
+        return self._aggregate(keys, counts, latency, top_n)
+
+    def _aggregate(self, keys: np.ndarray, counts: np.ndarray, latency: np.ndarray, top_n: int) -> Dict:
+        """Vectorized group-bys over (day, domain, status, violation, mask) cells weighted by count"""
+        total = int(counts.sum())
+        if not total:
+            return empty_dashboard()
+        categories = self.meta["categories"]
+        day = keys >> DAY_SHIFT
+        domains = (keys >> DOMAIN_SHIFT) & 0xFF
+        status = (keys >> STATUS_SHIFT) & 0xFF
+        violation = (keys >> VIOLATION_SHIFT) & 0xFFFF
+        violation_masks = keys & 0xFFFF
+
+        # Per-status lookup tables turn string logic into array indexing
+        status_names = categories["status"]
+        status_score = np.array([STATUS_SCORES.get(s, 0) for s in status_names], dtype=np.float64)
+        status_violating = np.array([s in VIOLATING_STATUSES for s in status_names], dtype=bool)
+        violating = status_violating[status]
+
+        status_counts = np.bincount(status, weights=counts, minlength=len(status_names))
+
+        violation_counts = np.bincount(violation[violating], weights=counts[violating],
+                                       minlength=len(categories["violation"]))
+        top = np.argsort(violation_counts, kind="stable")[::-1][:top_n]
+        top_violations = {categories["violation"][i]: int(violation_counts[i]) for i in top if violation_counts[i]}
+        # Per-code totals straight from the mask bits, weighted by cell count
+        per_code = code_counts(violation_masks, weights=counts)
+
+        first_day = int(day.min())
+        day_index = day - first_day
+        day_counts = np.bincount(day_index, weights=counts)
+        day_scores = np.bincount(day_index, weights=counts * status_score[status])
+        active_days = np.flatnonzero(day_counts)
+        dates = (active_days + first_day).astype("datetime64[D]").astype(str)
+        trend = dict(zip(dates.tolist(), (day_scores[active_days] / day_counts[active_days]).tolist()))
+
+        domain_names = categories["domain"]
+        domain_totals = np.bincount(domains, weights=counts, minlength=len(domain_names))
+        domain_violations = np.bincount(domains[violating], weights=counts[violating], minlength=len(domain_names))
+
+        return {
+            "status_distribution": {status_names[i]: int(c) for i, c in enumerate(status_counts) if c},
+            "top_violations": top_violations,
+            "violation_codes": {code: int(n) for code, n in zip(VIOLATION_CODES, per_code) if n},
+            "compliance_trend": trend,
+            "domain_breakdown": {
+                domain_names[i]: {"total": int(domain_totals[i]), "violations": int(domain_violations[i])}
+                for i in np.flatnonzero(domain_totals)
+            },
+            "total_analyses": total,
+            "avg_latency": float(latency.sum() / total)
+        }
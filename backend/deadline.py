@@ -0,0 +1,62 @@
+import contextvars
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+# Remaining budget forwarded by the gateway (relative, so host clocks don't need to agree)
+DEADLINE_HEADER = "x-deadline-ms"
+# Budget a direct client may ask for
+CLIENT_TIMEOUT_HEADER = "x-request-timeout-ms"
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+class Deadline:
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self.expires_at = time.monotonic() + budget_ms / 1000
+
+    def remaining(self) -> float:
+        """Seconds left (never negative)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+current_deadline: contextvars.ContextVar = contextvars.ContextVar("current_deadline", default=None)
+
+# Work abandoned because its deadline had passed, by stage
+cancelled_work = Counter()
+
+def deadline_from_headers(headers, default_ms: Optional[float] = None) -> Optional[Deadline]:
+    for name in (DEADLINE_HEADER, CLIENT_TIMEOUT_HEADER):
+        value = headers.get(name)
+        if value:
+            try:
+                return Deadline(max(0.0, float(value)))
+            except ValueError:
+                continue
+    return Deadline(default_ms) if default_ms else None
+
+def remaining_seconds() -> Optional[float]:
+    """Seconds left for the current request, or None when it has no deadline"""
+    deadline = current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+def check_deadline(stage: str):
+    """Stop before starting a stage whose result nobody will wait for"""
+    deadline = current_deadline.get()
+    if deadline is not None and deadline.expired():
+        cancelled_work[stage] += 1
+        raise DeadlineExceeded(stage)
+
+def record_cancelled(stage: str):
+    cancelled_work[stage] += 1
+
+def get_deadline_stats() -> Dict:
+    return {
+        "cancelled_by_stage": dict(cancelled_work),
+        "total_cancelled": sum(cancelled_work.values())
+    }
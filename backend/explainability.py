@@ -1,8 +1,76 @@
-from typing import List, Dict
+from collections import OrderedDict
+from typing import List, Dict, Optional
 import re
+import threading
+from rule_engine import decode_hits, encode_hits, RETENTION_KEYWORDS, SHARING_KEYWORDS, PHI_KEYWORDS
+from violation_codes import decode
+
+# The policy patterns restricted to the analyzer's keyword vocabulary (rule_engine.COMPLIANCE_KEYWORDS),
+# so stored analyses can be explained from their keyword hits without rescanning the text. This is
+# narrower than the free-text policy_patterns below: /explain only reports what the analyzer itself
+# looked at (e.g. personal_data is just "email"), and patterns with no keyword in the vocabulary,
+# like sox documentation, are left out rather than listed and never matched.
+KEYWORD_PATTERNS = {
+    'gdpr': {
+        'personal_data': ("email",),
+        'consent': ("consent", "permission"),
+        'storage': RETENTION_KEYWORDS,
+        'processing': SHARING_KEYWORDS
+    },
+    'hipaa': {
+        'phi': PHI_KEYWORDS,
+        'access_control': ("authorization", "secure"),
+        'encryption': ("encrypt", "unencrypted")
+    },
+    'sox': {
+        'financial_data': ("financial",),
+        'controls': ("control",)
+    }
+}
+
+POLICY_MAPPING = {
+    'gdpr': {
+        'personal_data': 'GDPR Article 4 - Personal Data Definition',
+        'consent': 'GDPR Article 6 - Lawful Basis for Processing',
+        'storage': 'GDPR Article 5 - Data Minimization Principle'
+    },
+    'hipaa': {
+        'phi': 'HIPAA Privacy Rule - Protected Health Information',
+        'access_control': 'HIPAA Security Rule - Access Control',
+        'encryption': 'HIPAA Security Rule - Encryption Standards'
+    },
+    'sox': {
+        'financial_data': 'SOX Section 302 - Financial Disclosure',
+        'controls': 'SOX Section 404 - Internal Controls',
+        'documentation': 'SOX Section 409 - Real-time Disclosure'
+    }
+}
+
+# Confidence of each reasoning step; the chain's score is their mean
+CLASSIFICATION_CONFIDENCE = 0.95
+DETECTION_CONFIDENCE = 0.88
+MAPPING_CONFIDENCE = 0.82
+RISK_CONFIDENCE = 0.90
+DECISION_CONFIDENCE = 0.85
 
 class ExplainabilityEngine:
-    def __init__(self):
+    def __init__(self, max_cached: int = 1024):
+        # analysis id -> reasoning chain; stored analyses never change, so entries never go stale
+        self.cache = OrderedDict()
+        self.max_cached = max_cached
+        self.cache_lock = threading.Lock()
+        self.stats = {"explained": 0, "cache_hits": 0}
+        # domain -> (keywords of any pattern, keywords of patterns that map to a policy) as hit masks,
+        # so /analyze can report the chain's confidence without building it
+        self.confidence_masks = {
+            domain: (
+                encode_hits(frozenset(k for keywords in patterns.values() for k in keywords)),
+                encode_hits(frozenset(
+                    k for name, keywords in patterns.items() if name in POLICY_MAPPING[domain] for k in keywords
+                ))
+            )
+            for domain, patterns in KEYWORD_PATTERNS.items()
+        }
         self.policy_patterns = {
             'gdpr': {
                 'personal_data': r'(email|phone|address|name|ip.?address|user.?id)',
@@ -23,17 +91,7 @@ class ExplainabilityEngine:
         }
 
     def generate_reasoning_chain(self, input_text: str, domain: str, analysis_result: Dict) -> List[Dict]:
-        reasoning_steps = []
-        
-        # Step 1: Input Classification
-        reasoning_steps.append({
-            "step": 1,
-            "action": "Input Classification",
-            "finding": f"Analyzing {len(input_text.split())} words for {domain.upper()} compliance",
-            "confidence": 0.95
-        })
-
-        # Step 2: Pattern Detection
+        # Pattern Detection
         patterns = self.policy_patterns.get(domain.lower(), {})
         detected_patterns = []
         
@@ -46,13 +104,70 @@ class ExplainabilityEngine:
                     "count": len(matches)
                 })
 
+        return self.build_reasoning_chain(
+            f"Analyzing {len(input_text.split())} words for {domain.upper()} compliance",
+            detected_patterns, domain, analysis_result
+        )
+
+    def explain_analysis(self, record: Dict) -> List[Dict]:
+        """Reasoning chain for a stored analysis, from its keyword hits (see rule_engine.encode_hits)"""
+        domain = record["domain"]
+        hits = decode_hits(record.get("keyword_mask", 0))
+        detected_patterns = []
+        for pattern_name, keywords in KEYWORD_PATTERNS.get(domain.lower(), {}).items():
+            matches = [keyword for keyword in keywords if keyword in hits]
+            if matches:
+                detected_patterns.append({
+                    "pattern": pattern_name,
+                    "matches": matches,
+                    "count": len(matches)
+                })
+
+        chain = self.build_reasoning_chain(
+            f"Analyzed {record.get('input_length', 0)} characters for {domain.upper()} compliance",
+            detected_patterns, domain, record
+        )
+        codes = decode(record.get("violation_mask", 0))
+        if codes:
+            # Show the violation codes that decided the status next to the final decision
+            chain[-1]["details"] = codes
+        return chain
+
+    def get_explanation(self, analysis_id: int) -> Optional[List[Dict]]:
+        with self.cache_lock:
+            chain = self.cache.get(analysis_id)
+            if chain is not None:
+                self.cache.move_to_end(analysis_id)
+                self.stats["cache_hits"] += 1
+            return chain
+
+    def store_explanation(self, analysis_id: int, chain: List[Dict]):
+        with self.cache_lock:
+            self.stats["explained"] += 1
+            self.cache[analysis_id] = chain
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+
+    def build_reasoning_chain(self, classification: str, detected_patterns: List[Dict], domain: str,
+                              analysis_result: Dict) -> List[Dict]:
+        reasoning_steps = []
+        
+        # Step 1: Input Classification
+        reasoning_steps.append({
+            "step": 1,
+            "action": "Input Classification",
+            "finding": classification,
+            "confidence": CLASSIFICATION_CONFIDENCE
+        })
+
+        # Step 2: Pattern Detection
         if detected_patterns:
             reasoning_steps.append({
                 "step": 2,
                 "action": "Pattern Detection",
                 "finding": f"Detected {len(detected_patterns)} compliance-relevant patterns",
                 "details": detected_patterns,
-                "confidence": 0.88
+                "confidence": DETECTION_CONFIDENCE
             })
 
         # Step 3: Policy Mapping
@@ -63,7 +178,7 @@ class ExplainabilityEngine:
                 "action": "Policy Mapping",
                 "finding": f"Mapped to {len(policy_violations)} potential policy violations",
                 "details": policy_violations,
-                "confidence": 0.82
+                "confidence": MAPPING_CONFIDENCE
             })
 
         # Step 4: Risk Assessment
@@ -72,7 +187,7 @@ class ExplainabilityEngine:
             "step": 4,
             "action": "Risk Assessment",
             "finding": f"Calculated risk level: {risk_level}",
-            "confidence": 0.90
+            "confidence": RISK_CONFIDENCE
         })
 
         # Step 5: Final Decision
@@ -80,32 +195,14 @@ class ExplainabilityEngine:
             "step": 5,
             "action": "Final Decision",
             "finding": f"Status: {analysis_result['status']} - {analysis_result['violation_summary']}",
-            "confidence": 0.85
+            "confidence": DECISION_CONFIDENCE
         })
 
         return reasoning_steps
 
     def map_to_policies(self, patterns: List[Dict], domain: str) -> List[Dict]:
-        policy_mapping = {
-            'gdpr': {
-                'personal_data': 'GDPR Article 4 - Personal Data Definition',
-                'consent': 'GDPR Article 6 - Lawful Basis for Processing',
-                'storage': 'GDPR Article 5 - Data Minimization Principle'
-            },
-            'hipaa': {
-                'phi': 'HIPAA Privacy Rule - Protected Health Information',
-                'access_control': 'HIPAA Security Rule - Access Control',
-                'encryption': 'HIPAA Security Rule - Encryption Standards'
-            },
-            'sox': {
-                'financial_data': 'SOX Section 302 - Financial Disclosure',
-                'controls': 'SOX Section 404 - Internal Controls',
-                'documentation': 'SOX Section 409 - Real-time Disclosure'
-            }
-        }
-
         violations = []
-        domain_policies = policy_mapping.get(domain.lower(), {})
+        domain_policies = POLICY_MAPPING.get(domain.lower(), {})
         
         for pattern in patterns:
             policy = domain_policies.get(pattern['pattern'])
@@ -131,4 +228,14 @@ class ExplainabilityEngine:
             return 0.0
         
         total_confidence = sum(step.get('confidence', 0.5) for step in reasoning_steps)
-        return round(total_confidence / len(reasoning_steps), 2)
\ No newline at end of file
+        return round(total_confidence / len(reasoning_steps), 2)
+
+    def estimate_confidence(self, domain: str, keyword_mask: int) -> float:
+        """The confidence /explain reports for these keyword hits, without building the chain"""
+        detected_mask, mapped_mask = self.confidence_masks.get(domain.lower(), (0, 0))
+        confidences = [CLASSIFICATION_CONFIDENCE, RISK_CONFIDENCE, DECISION_CONFIDENCE]
+        if keyword_mask & detected_mask:
+            confidences.append(DETECTION_CONFIDENCE)
+        if keyword_mask & mapped_mask:
+            confidences.append(MAPPING_CONFIDENCE)
+        return round(sum(confidences) / len(confidences), 2)
\ No newline at end of file
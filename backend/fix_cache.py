@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+class FixCache:
+    def __init__(self, max_entries: int = 256, max_speculative: int = 2,
+                 cacheable: Optional[Callable[[Dict], bool]] = None):
+        self.max_entries = max_entries
+        self.max_speculative = max_speculative
+        # Results that fail this (e.g. a fallback after a transient LLM error) are returned
+        # to whoever is waiting but not kept for later callers
+        self.cacheable = cacheable
+        self.entries = OrderedDict()  # key -> {"result", "speculative", "consumed"}
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.speculative_running = 0
+        self.stats = {
+            "pregenerations_started": 0,
+            "pregenerations_skipped_budget": 0,
+            "pregeneration_hits": 0,
+            "in_flight_attaches": 0,
+            "cache_hits": 0,
+            "misses": 0,
+            "wasted_pregenerations": 0,
+            "uncached_results": 0
+        }
+
+    @staticmethod
+    def make_key(input_text: str, domain: str) -> str:
+        """Cache key for a fix: domain plus whitespace/case-normalized content"""
+        normalized = " ".join(input_text.lower().split())
+        return hashlib.sha256(f"{domain.lower()}:{normalized}".encode("utf-8")).hexdigest()
+
+    def schedule(self, input_text: str, domain: str, generate: Callable[[], Dict]) -> bool:
+        """Start a speculative background generation if the budget allows"""
+        key = self.make_key(input_text, domain)
+        if key in self.entries or key in self.in_flight:
+            return False
+
+        if self.speculative_running >= self.max_speculative:
+            self.stats["pregenerations_skipped_budget"] += 1
+            return False
+
+        self.speculative_running += 1
+        self.stats["pregenerations_started"] += 1
+        # Fresh context: speculative work must not inherit the triggering request's deadline
+        self.in_flight[key] = asyncio.create_task(
+            self._run(key, generate, speculative=True), context=contextvars.Context()
+        )
+        return True
+
+    async def get_or_generate(self, input_text: str, domain: str, generate: Callable[[], Dict]) -> Tuple[Dict, str]:
+        """Return (fix, source) where source is 'cache', 'in_flight' or 'generated'"""
+        key = self.make_key(input_text, domain)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self._mark_consumed(entry)
+            self.stats["cache_hits"] += 1
+            return entry["result"], "cache"
+
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.stats["in_flight_attaches"] += 1
+            # Shield so a disconnecting client doesn't cancel a generation others share
+            result = await asyncio.shield(task)
+            if result is not None:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self._mark_consumed(entry)
+                return result, "in_flight"
+
+        self.stats["misses"] += 1
+        # Fresh context: the shared generation must not inherit this caller's deadline; each
+        # caller bounds only its own wait
+        task = asyncio.create_task(self._run(key, generate, speculative=False), context=contextvars.Context())
+        self.in_flight[key] = task
+        result = await asyncio.shield(task)
+        return result, "generated"
+
+    async def _run(self, key: str, generate: Callable[[], Dict], speculative: bool) -> Optional[Dict]:
+        try:
+            # Policy generation is a blocking LLM call; keep it off the event loop
+            result = await asyncio.to_thread(generate)
+        except Exception:
+            if not speculative:
+                raise
+            self.stats["wasted_pregenerations"] += 1
+            return None
+        finally:
+            self.in_flight.pop(key, None)
+            if speculative:
+                self.speculative_running -= 1
+
+        if self.cacheable is not None and not self.cacheable(result):
+            self.stats["uncached_results"] += 1
+            if speculative:
+                self.stats["wasted_pregenerations"] += 1
+            return result
+        self._store(key, result, speculative)
+        return result
+
+    def _store(self, key: str, result: Dict, speculative: bool):
+        self.entries[key] = {"result": result, "speculative": speculative, "consumed": not speculative}
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            if evicted["speculative"] and not evicted["consumed"]:
+                self.stats["wasted_pregenerations"] += 1
+
+    def _mark_consumed(self, entry: Dict):
+        if entry["speculative"] and not entry["consumed"]:
+            entry["consumed"] = True
+            self.stats["pregeneration_hits"] += 1
+
+    def get_stats(self) -> Dict:
+        started = self.stats["pregenerations_started"]
+        return {
+            **self.stats,
+            "pregeneration_hit_rate": round(self.stats["pregeneration_hits"] / started, 3) if started else 0.0,
+            "cached_fixes": len(self.entries),
+            "in_flight": len(self.in_flight),
+            "speculative_running": self.speculative_running,
+            "max_speculative": self.max_speculative
+        }
@@ -1,26 +1,68 @@
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
+import bisect
+import json
+import os
 import re
 
+import numpy as np
+from violation_codes import regulation_mask, regulation_counts
+
+# Column order of the violation-count matrix taken by grade_corpus()
+REGULATIONS = ("GDPR_violations", "CCPA_violations", "HIPAA_violations", "SOX_violations")
+# Violation-code bits counted under each regulation
+REGULATION_MASKS = {regulation: regulation_mask(regulation.split("_")[0]) for regulation in REGULATIONS}
+
+# Upper penalty bound of each grade but the last: 0 -> A+, <=5 -> A, ... >50 -> F
+GRADE_THRESHOLDS = np.array([0, 5, 15, 30, 50])
+GRADES = np.array(["A+", "A", "B", "C", "D", "F"])
+
 class ComplianceGradingSystem:
-    def __init__(self):
+    def __init__(self, weights_path: Optional[str] = None):
         self.violation_weights = {
             "CRITICAL": 25,
             "HIGH": 15, 
             "MEDIUM": 8,
             "LOW": 3
         }
+        # tenant id -> severity -> weight, overriding violation_weights for that tenant
+        self.tenant_weights: Dict[str, Dict[str, float]] = {}
+        self.weights_path = weights_path or os.getenv("GRADING_WEIGHTS_CONFIG")
+        self.load_tenant_weights()
+
+    def load_tenant_weights(self):
+        """Read {"tenant": {"CRITICAL": 30, ...}} from the weights config, if there is one"""
+        if not self.weights_path:
+            return
+        try:
+            with open(self.weights_path, 'r') as f:
+                config = json.load(f)
+            self.tenant_weights = {
+                tenant: {severity: float(weight) for severity, weight in weights.items()}
+                for tenant, weights in config.items()
+            }
+        except (OSError, ValueError, AttributeError):
+            # Keep the previous weights rather than grading with a half-read config
+            pass
+
+    def weights_for(self, tenant: Optional[str] = None) -> Dict[str, float]:
+        return {**self.violation_weights, **self.tenant_weights.get(tenant, {})}
 
-    def calculate_compliance_grade(self, analysis_result: Dict, input_text: str) -> Dict:
-        """Calculate letter grade (A-F) based on violations"""
+    def calculate_compliance_grade(self, analysis_result: Dict, input_text: str, tenant: Optional[str] = None) -> Dict:
+        """Calculate letter grade (A-F) based on violations, with the tenant's severity weights"""
         
-        # Count specific violations by type
-        violation_counts = self.count_violations(input_text, analysis_result.get("evidence", []))
+        # Count specific violations by type: popcounts of the analyzer's mask when there is one
+        violation_mask = analysis_result.get("violation_mask")
+        if violation_mask:
+            violation_counts = self.count_violation_bits(violation_mask)
+        else:
+            violation_counts = self.count_violations(input_text, analysis_result.get("evidence", []))
         
         # Calculate total penalty points
+        weights = self.weights_for(tenant)
         total_penalty = 0
         for violation_type, count in violation_counts.items():
             severity = self.get_violation_severity(violation_type)
-            total_penalty += count * self.violation_weights.get(severity, 5)
+            total_penalty += count * weights.get(severity, 5)
         
         # Convert to letter grade
         letter_grade = self.penalty_to_grade(total_penalty)
@@ -38,6 +80,9 @@ class ComplianceGradingSystem:
             "grade_explanation": self.get_grade_explanation(letter_grade)
         }
 
+    def count_violation_bits(self, violation_mask: int) -> Dict[str, int]:
+        return {regulation: (violation_mask & mask).bit_count() for regulation, mask in REGULATION_MASKS.items()}
+
     def count_violations(self, input_text: str, evidence: List[str]) -> Dict[str, int]:
         """Count specific violations by regulation"""
         violations = {
@@ -85,18 +130,46 @@ class ComplianceGradingSystem:
 
     def penalty_to_grade(self, penalty_points: int) -> str:
         """Convert penalty points to letter grade"""
-        if penalty_points == 0:
-            return "A+"
-        elif penalty_points <= 5:
-            return "A"
-        elif penalty_points <= 15:
-            return "B"
-        elif penalty_points <= 30:
-            return "C"
-        elif penalty_points <= 50:
-            return "D"
-        else:
-            return "F"
+        return str(GRADES[bisect.bisect_left(GRADE_THRESHOLDS.tolist(), penalty_points)])
+
+    def grade_corpus(self, violation_counts, tenant: Optional[str] = None,
+                     regulations: Sequence[str] = REGULATIONS) -> Dict[str, np.ndarray]:
+        """Grade many documents at once from a (documents x regulations) violation-count matrix.
+
+        Same scoring as calculate_compliance_grade, as array operations. percentile_rank is
+        the share of the corpus each document scores better than, ties counting half.
+        """
+        counts = np.asarray(violation_counts, dtype=np.float64)
+        if counts.ndim != 2 or counts.shape[1] != len(regulations):
+            raise ValueError(f"Expected a (documents x {len(regulations)}) violation count matrix, got shape {counts.shape}")
+
+        weights = self.weights_for(tenant)
+        weight_vector = np.array([weights.get(self.get_violation_severity(r), 5) for r in regulations], dtype=np.float64)
+        penalties = counts @ weight_vector
+
+        # max_possible_penalty is 100, so each penalty point costs one percent
+        percentage_scores = np.round(np.maximum(0.0, 100.0 - penalties), 1)
+        letter_grades = GRADES[np.searchsorted(GRADE_THRESHOLDS, penalties, side="left")]
+
+        ordered = np.sort(penalties)
+        lower = np.searchsorted(ordered, penalties, side="left")
+        not_higher = np.searchsorted(ordered, penalties, side="right")
+        # Documents with a larger penalty score worse than this one
+        worse = len(penalties) - not_higher
+        percentile_ranks = np.round((worse + 0.5 * (not_higher - lower)) / max(1, len(penalties)) * 100, 1)
+
+        return {
+            "penalty_points": penalties,
+            "percentage_scores": percentage_scores,
+            "letter_grades": letter_grades,
+            "percentile_ranks": percentile_ranks,
+            "total_violations": counts.sum(axis=1)
+        }
+
+    def grade_masks(self, violation_masks, tenant: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """grade_corpus() for an array of analyzer violation masks"""
+        counts = regulation_counts(violation_masks, REGULATION_MASKS.values())
+        return self.grade_corpus(counts, tenant=tenant, regulations=tuple(REGULATION_MASKS))
 
     def get_grade_explanation(self, grade: str) -> str:
         """Provide explanation for the grade"""
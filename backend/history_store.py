@@ -0,0 +1,261 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    status TEXT NOT NULL,
+    record TEXT NOT NULL,
+    feedback TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_ts ON analyses (ts);
+"""
+
+class PendingWrite:
+    def __init__(self, record: Dict):
+        self.record = record
+        self.id: Optional[int] = None
+        self.error: Optional[Exception] = None
+        self.id_ready = threading.Event()  # inserted, not yet committed
+        self.done = threading.Event()  # committed (or failed)
+
+class HistoryStore:
+    """Append-only analysis history (sqlite in WAL mode) with group-committed writes.
+
+    Concurrent appends share one transaction. Durable callers block until it commits; others
+    get their id as soon as the row is inserted, and get() serves such rows from memory until
+    the commit lands. The writer holds sqlite's write lock for the whole batch, so ids still
+    become visible in order. sqlite's own locking makes several worker processes safe to
+    point at the same file; busy_timeout covers the short write-lock waits between them.
+    Ids handed out from a batch that then fails are never issued again.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 256, batch_wait_ms: float = 5.0,
+                 checkpoint_interval: float = 60.0, write_timeout: float = 60.0):
+        self.db_path = db_path
+        self.write_timeout = write_timeout
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.checkpoint_interval = checkpoint_interval
+        self.lock = threading.Lock()
+        self.conn = self._connect()
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        # The writer thread's own connection, in autocommit mode so it controls the transaction
+        self.write_conn = self._connect()
+        self.write_conn.isolation_level = None
+        self.pending: "queue.Queue[PendingWrite]" = queue.Queue()
+        self.uncommitted: Dict[int, PendingWrite] = {}
+        # Highest id handed out by a batch that was rolled back; AUTOINCREMENT would reuse it
+        self.burned_id = 0
+        self.stats = {"appended": 0, "commits": 0, "failed_appends": 0, "feedback_updates": 0, "checkpoints": 0}
+        self.closed = threading.Event()
+        self.writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self.writer.start()
+        self.compactor = threading.Thread(target=self._compact_loop, name="history-compactor", daemon=True)
+        self.compactor.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def append(self, record: Dict, durable: bool = True) -> int:
+        """Append one record and return its id.
+
+        With durable=False this returns once the row has its id, without waiting for the
+        commit; a failed commit is then only counted in stats["failed_appends"].
+        """
+        write = PendingWrite(record)
+        self.pending.put(write)
+        if not (write.done if durable else write.id_ready).wait(self.write_timeout):
+            raise TimeoutError(f"History write not {'committed' if durable else 'queued'} within {self.write_timeout}s")
+        if write.error is not None:
+            raise write.error
+        return write.id
+
+    def _write_loop(self):
+        while not self.closed.is_set() or not self.pending.empty():
+            try:
+                write = self.pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._write_batch(write)
+            except Exception as e:
+                # Never let the writer die: appends would wait on it until they time out
+                write.error = write.error or e
+                write.id_ready.set()
+                write.done.set()
+
+    def _write_batch(self, first: PendingWrite):
+        batch: List[PendingWrite] = []
+        write = first
+        try:
+            self.write_conn.execute("BEGIN IMMEDIATE")
+            if self.burned_id:
+                self._skip_ids(self.burned_id)
+            # Give concurrent writers a moment to join this commit
+            deadline = time.monotonic() + self.batch_wait
+            while True:
+                row = self._row(write)
+                if row is not None:
+                    batch.append(write)
+                    self._insert(write, row)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    write = self.pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            self.write_conn.execute("COMMIT")
+            self.burned_id = 0
+            if batch:
+                self.stats["appended"] += len(batch)
+                self.stats["commits"] += 1
+        except Exception as e:
+            # Non-durable callers may already hold these ids; the next batch skips past them
+            self.burned_id = max([self.burned_id] + [w.id for w in batch if w.id is not None])
+            if self.write_conn.in_transaction:
+                try:
+                    self.write_conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            if write not in batch and not write.done.is_set():
+                # Dequeued but failed before it joined the batch (e.g. BEGIN itself failed)
+                batch.append(write)
+            self.stats["failed_appends"] += len(batch)
+            for failed in batch:
+                failed.error = e
+                failed.id_ready.set()
+        for write in batch:
+            self.uncommitted.pop(write.id, None)
+            write.done.set()
+
+    def _skip_ids(self, last_id: int):
+        """Move the AUTOINCREMENT counter past last_id (inside the batch's transaction)"""
+        updated = self.write_conn.execute(
+            "UPDATE sqlite_sequence SET seq = ? WHERE name = 'analyses' AND seq < ?", (last_id, last_id)
+        ).rowcount
+        if not updated:
+            self.write_conn.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT 'analyses', ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'analyses')", (last_id,)
+            )
+
+    def _row(self, write: PendingWrite) -> Optional[tuple]:
+        """The write's column values, or None (and the write failed alone) if the record is malformed"""
+        record = write.record
+        try:
+            return (record["timestamp"], record["domain"], record["status"],
+                    json.dumps(record), record.get("feedback"))
+        except (KeyError, TypeError, ValueError) as e:
+            self.stats["failed_appends"] += 1
+            write.error = e
+            write.id_ready.set()
+            write.done.set()
+            return None
+
+    def _insert(self, write: PendingWrite, row: tuple):
+        cursor = self.write_conn.execute(
+            "INSERT INTO analyses (ts, domain, status, record, feedback) VALUES (?, ?, ?, ?, ?)", row
+        )
+        write.id = cursor.lastrowid
+        self.uncommitted[write.id] = write
+        write.id_ready.set()
+
+    def update_feedback(self, record_id: int, feedback: str) -> bool:
+        write = self.uncommitted.get(record_id)
+        if write is not None:
+            write.done.wait()
+        with self.lock, self.conn:
+            updated = self.conn.execute(
+                "UPDATE analyses SET feedback = ? WHERE id = ?", (feedback, record_id)
+            ).rowcount
+        if updated:
+            self.stats["feedback_updates"] += 1
+        return bool(updated)
+
+    def iter_records(self, after_id: int = 0, chunk_size: int = 10000) -> Iterator[Dict]:
+        """Records in id order, each with its id and current feedback (read in bounded chunks)"""
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT id, record, feedback FROM analyses WHERE id > ? ORDER BY id LIMIT ?",
+                    (after_id, chunk_size)
+                ).fetchall()
+            for record_id, record, feedback in rows:
+                yield {**json.loads(record), "id": record_id, "feedback": feedback}
+            if len(rows) < chunk_size:
+                return
+            after_id = rows[-1][0]
+
+    def get(self, record_id: int) -> Optional[Dict]:
+        write = self.uncommitted.get(record_id)
+        if write is not None and write.error is None:
+            return {**write.record, "id": record_id, "feedback": write.record.get("feedback")}
+        with self.lock:
+            row = self.conn.execute("SELECT record, feedback FROM analyses WHERE id = ?", (record_id,)).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[0]), "id": record_id, "feedback": row[1]}
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    def import_legacy_json(self, json_path: str) -> int:
+        """One-time migration of the old rewrite-everything JSON history file"""
+        if not os.path.exists(json_path):
+            return 0
+        with self.lock:
+            # Take the write lock first so two workers starting together can't both import
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not os.path.exists(json_path):
+                    self.conn.rollback()
+                    return 0
+                with open(json_path, 'r') as f:
+                    records = json.load(f)
+                self.conn.executemany(
+                    "INSERT INTO analyses (ts, domain, status, record, feedback) VALUES (?, ?, ?, ?, ?)",
+                    [(r["timestamp"], r["domain"], r["status"], json.dumps(r), r.get("feedback")) for r in records]
+                )
+                os.replace(json_path, json_path + ".migrated")
+                self.conn.commit()
+            except (OSError, ValueError, KeyError):
+                # Unreadable legacy file: leave it for inspection, start fresh
+                self.conn.rollback()
+                return 0
+        return len(records)
+
+    def _compact_loop(self):
+        # Fold the WAL back into the main file so it doesn't grow without bound
+        while not self.closed.wait(self.checkpoint_interval):
+            self.checkpoint()
+
+    def checkpoint(self):
+        try:
+            with self.lock:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self.conn.execute("PRAGMA optimize")
+            self.stats["checkpoints"] += 1
+        except sqlite3.Error:
+            # Another process holds the write lock; try again next interval
+            pass
+
+    def close(self):
+        self.closed.set()
+        self.writer.join()
+        self.write_conn.close()
+        with self.lock:
+            self.conn.close()
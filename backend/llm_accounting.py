@@ -0,0 +1,127 @@
+import json
+import math
+import os
+import threading
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+class LLMUsageTracker:
+    def __init__(self, data_file: str = "llm_usage.jsonl", window: int = 200, min_samples: int = 20,
+                 headroom: float = 1.25, min_max_tokens: int = 96):
+        self.data_file = data_file
+        self.window = window
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.min_max_tokens = min_max_tokens
+        self._lock = threading.Lock()
+        # domain -> recent (completion_tokens, truncated) samples driving the adaptive cap
+        self.recent = defaultdict(lambda: deque(maxlen=self.window))
+        self.totals = defaultdict(lambda: {
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": 0.0, "truncated": 0
+        })
+        # Bytes of the usage file already applied; the file is shared by all workers
+        self.offset = 0
+        with self._lock:
+            self.load_usage()
+
+    def load_usage(self):
+        """Apply records appended since the last read (replays everything on startup).
+
+        Every worker appends to the same file and tails it, so caps and stats agree across
+        workers. Call with the lock held.
+        """
+        if not os.path.exists(self.data_file):
+            return
+        try:
+            with open(self.data_file, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except OSError:
+            return
+        # Leave a line another worker is still writing for the next read
+        complete = data.rfind(b"\n") + 1
+        self.offset += complete
+        for line in data[:complete].splitlines():
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError):
+                continue
+
+    def record(self, endpoint: str, domain: str, prompt_tokens: int, completion_tokens: int,
+               latency_ms: float, max_tokens: int, finish_reason: Optional[str] = None):
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "endpoint": endpoint,
+            "domain": domain.lower(),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_ms": round(latency_ms, 1),
+            "max_tokens": max_tokens,
+            "truncated": finish_reason == "length"
+        }
+        with self._lock:
+            # One append per record; picked up (with other workers' records) by load_usage
+            with open(self.data_file, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+            self.load_usage()
+
+    def _apply(self, record: Dict):
+        domain = record["domain"]
+        self.recent[domain].append((record["completion_tokens"], record["truncated"]))
+        totals = self.totals[domain]
+        totals["calls"] += 1
+        totals["prompt_tokens"] += record["prompt_tokens"]
+        totals["completion_tokens"] += record["completion_tokens"]
+        totals["latency_ms"] += record["latency_ms"]
+        totals["truncated"] += int(record["truncated"])
+
+    def recommend_max_tokens(self, domain: str, default: int) -> int:
+        """Cap completions at the observed p95 plus headroom, never above the default"""
+        with self._lock:
+            self.load_usage()
+            samples = list(self.recent.get(domain.lower(), ()))
+
+        if len(samples) < self.min_samples:
+            return default
+
+        # A truncated completion means the cap was too tight; back off to the default
+        if any(truncated for _, truncated in samples[-self.min_samples:]):
+            return default
+
+        lengths = sorted(tokens for tokens, _ in samples)
+        p95 = lengths[min(len(lengths) - 1, math.ceil(0.95 * len(lengths)) - 1)]
+        cap = int(math.ceil(p95 * self.headroom / 16.0) * 16)
+        return max(self.min_max_tokens, min(default, cap))
+
+    def get_stats(self, default_max_tokens: int = 400) -> Dict:
+        with self._lock:
+            self.load_usage()
+            domains = {}
+            for domain, totals in self.totals.items():
+                calls = totals["calls"]
+                lengths = sorted(tokens for tokens, _ in self.recent[domain])
+                domains[domain] = {
+                    **totals,
+                    "latency_ms": round(totals["latency_ms"], 1),
+                    "avg_latency_ms": round(totals["latency_ms"] / calls, 1) if calls else 0,
+                    "avg_prompt_tokens": round(totals["prompt_tokens"] / calls, 1) if calls else 0,
+                    "avg_completion_tokens": round(totals["completion_tokens"] / calls, 1) if calls else 0,
+                    "median_completion_tokens": lengths[len(lengths) // 2] if lengths else 0
+                }
+
+        for domain in domains:
+            domains[domain]["recommended_max_tokens"] = self.recommend_max_tokens(domain, default_max_tokens)
+
+        return {
+            "domains": domains,
+            "total_calls": sum(d["calls"] for d in domains.values()),
+            "total_tokens": sum(d["prompt_tokens"] + d["completion_tokens"] for d in domains.values())
+        }
+
+def token_usage(response, prompt: str, completion: str) -> Tuple[int, int]:
+    """Token counts from the API response, estimated (~4 chars/token) if usage is missing"""
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+        return usage.prompt_tokens, usage.completion_tokens
+    return max(1, len(prompt) // 4), max(1, len(completion) // 4)
@@ -1,11 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import openai
 import time
 import os
+import asyncio
+import numpy as np
+from typing import FrozenSet, List, Optional, Tuple
 from dotenv import load_dotenv
-from grading_system import ComplianceGradingSystem
+from grading_system import ComplianceGradingSystem, REGULATIONS
+from policy_generator import ProactivePolicyGenerator
+from fix_cache import FixCache
+from llm_accounting import LLMUsageTracker
+from rule_engine import (
+    normalize_text, normalize_preserving_offsets, scan_keywords, scan_matches, match_spans,
+    evaluate_rules, encode_hits, decode_scan_summary, scan_secret_from_env
+)
+from report_generator import ComplianceReportGenerator
+from analytics import ComplianceAnalytics
+from explainability import ExplainabilityEngine
+from violation_codes import decode
+from deadline import (
+    DeadlineExceeded, current_deadline, deadline_from_headers, check_deadline,
+    remaining_seconds, record_cancelled, get_deadline_stats
+)
+from metrics import registry, stage, observe_request, current_breakdown, wants_timings, server_timing
+from profiler import profiler, current_profile, PROFILE_ID_HEADER
 
 load_dotenv()
 
@@ -19,6 +40,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Requests without a deadline header get this budget (unset = no deadline)
+DEFAULT_DEADLINE_MS = float(os.getenv("BACKEND_DEFAULT_DEADLINE_MS", "0")) or None
+
+@app.middleware("http")
+async def propagate_deadline(request: Request, call_next):
+    """Make the caller's remaining time budget visible to every stage of this request"""
+    deadline = deadline_from_headers(request.headers, DEFAULT_DEADLINE_MS)
+    if deadline is not None and deadline.expired():
+        record_cancelled("request")
+        return JSONResponse(status_code=504, content={"detail": "Deadline exceeded before processing started"})
+    token = current_deadline.set(deadline)
+    try:
+        return await call_next(request)
+    finally:
+        current_deadline.reset(token)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Request counters/latency for /metrics, plus a Server-Timing stage breakdown on request"""
+    breakdown = {} if wants_timings(request.headers) else None
+    token = current_breakdown.set(breakdown)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_breakdown.reset(token)
+    route = request.scope.get("route")
+    observe_request(route.path if route else "unmatched", request.method, response.status_code,
+                    time.perf_counter() - start)
+    if breakdown:
+        response.headers["Server-Timing"] = server_timing(breakdown)
+    return response
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Sample this request's stacks when asked to (debug only) or picked by global sampling"""
+    requested = profiler.requested(request.headers)
+    if not requested and not profiler.sampled():
+        return await call_next(request)
+    session = profiler.start(f"{request.method} {request.url.path}", requested)
+    token = current_profile.set(session)
+    try:
+        response = await call_next(request)
+    finally:
+        current_profile.reset(token)
+        profiler.stop(session)
+    response.headers[PROFILE_ID_HEADER] = session.profile_id
+    return response
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc), "stage": exc.stage})
+
 # Real Cerebras API configuration
 try:
     cerebras_client = openai.OpenAI(
@@ -31,10 +105,37 @@ except Exception as e:
     cerebras_client = None
 
 grading_system = ComplianceGradingSystem()
+report_generator = ComplianceReportGenerator()
+analytics = ComplianceAnalytics()
+# Reasoning chains are built on demand by /explain, never on the /analyze hot path
+explainability_engine = ExplainabilityEngine(max_cached=int(os.getenv("EXPLANATION_CACHE_SIZE", "1024")))
+llm_usage = LLMUsageTracker(os.getenv("LLM_USAGE_FILE", "llm_usage.jsonl"))
+policy_generator = ProactivePolicyGenerator(usage_tracker=llm_usage)
+
+# Fixes are cached per content so "apply fix" after an analysis can return immediately
+fix_cache = FixCache(
+    max_entries=int(os.getenv("FIX_CACHE_SIZE", "256")),
+    max_speculative=int(os.getenv("FIX_PREGENERATION_CONCURRENCY", "2")),
+    cacheable=policy_generator.is_cacheable
+)
+PREGENERATE_FIXES_DEFAULT = os.getenv("PREGENERATE_FIXES", "false").lower() == "true"
+
+# When set, keyword scans signed by the MCP gateway with this secret are reused
+GATEWAY_SCAN_SECRET = scan_secret_from_env()
 
 class AnalysisRequest(BaseModel):
     input_text: str
     analysis_type: str = "gdpr"
+    pregenerate_fix: bool = PREGENERATE_FIXES_DEFAULT
+    match_spans: bool = False  # return where each violation matched
+    span_start: Optional[int] = None  # only spans overlapping [span_start, span_end)
+    span_end: Optional[int] = None
+    tenant: Optional[str] = None  # grading weights (see GRADING_WEIGHTS_CONFIG); or X-Tenant-Id
+
+    def span_range(self) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        if self.match_spans or self.span_start is not None or self.span_end is not None:
+            return self.span_start, self.span_end
+        return None
 
 class ComplianceResult(BaseModel):
     status: str
@@ -42,13 +143,26 @@ class ComplianceResult(BaseModel):
     reasoning: str
     suggestion: str
     evidence: list
+    violation_mask: int = 0  # bit i = violation_codes.VIOLATION_CODES[i]
+    keyword_mask: int = Field(0, exclude=True)  # keyword hits, stored so /explain needn't rescan
+    match_spans: Optional[list] = None  # sorted [start, end, violation code id], only when requested
     latency_ms: int
     compliance_grade: dict = {}
 
-    reasoning_chain: list = []
-    confidence_score: float = 0.0
+    reasoning_chain: list = []  # built on demand by GET /explain/{analysis_id}
+    confidence_score: float = 0.0  # the score /explain reports, estimated from the keyword hits
+    partial: bool = False
+    analysis_id: Optional[int] = None
+    stage_timings_ms: Optional[dict] = None  # only when requested with X-Stage-Timings
 
-def analyze_compliance(input_text: str, analysis_type: str) -> ComplianceResult:
+class CorpusGradeRequest(BaseModel):
+    violation_counts: Optional[List[List[float]]] = None  # one row per document, one column per regulation
+    violation_masks: Optional[List[int]] = None  # or one analyzer violation_mask per document
+    regulations: List[str] = list(REGULATIONS)
+    tenant: Optional[str] = None
+
+def analyze_compliance(input_text: str, analysis_type: str, keyword_hits: Optional[FrozenSet[str]] = None,
+                       span_range: Optional[Tuple[Optional[int], Optional[int]]] = None) -> ComplianceResult:
     start_time = time.time()
     
     if not input_text or len(input_text.strip()) < 5:
@@ -61,39 +175,32 @@ def analyze_compliance(input_text: str, analysis_type: str) -> ComplianceResult:
             latency_ms=0
         )
     
-    # Pattern-based compliance analysis (reliable)
-    violations = []
-    input_lower = input_text.lower().replace('_', ' ').replace('-', ' ')
-    
-    # GDPR violations
-    if "email" in input_lower and "consent" not in input_lower:
-        violations.append("GDPR_NoConsent")
-    if any(word in input_lower for word in ["forever", "permanent", "indefinitely"]):
-        violations.append("GDPR_DataRetention")
-    if any(phrase in input_lower for phrase in ["third party", "send to third", "share with"]):
-        violations.append("GDPR_DataSharing")
-    
-    # HIPAA violations
-    if any(word in input_lower for word in ["patient", "medical", "health", "phi"]) and "encrypt" not in input_lower:
-        violations.append("HIPAA_Encryption")
-    if "unencrypted" in input_lower:
-        violations.append("HIPAA_Security")
-    
-    # SOX violations
-    if "financial" in input_lower and "control" not in input_lower:
-        violations.append("SOX_Controls")
-    
-    # Check for good patterns
-    good_patterns = ["consent", "encrypt", "expiry", "authorization", "secure", "permission"]
-    has_good_patterns = any(pattern in input_lower for pattern in good_patterns)
+    # Pattern-based compliance analysis (reliable); reuse the gateway's scan when given one.
+    # Spans need match offsets, which the gateway's summary doesn't carry, so scan for those.
+    matches = None
+    if span_range is not None:
+        with stage("normalize"):
+            normalized = normalize_preserving_offsets(input_text)
+        with stage("rule_scan"):
+            keyword_hits, matches = scan_matches(normalized)
+            violations, has_good_patterns = evaluate_rules(keyword_hits)
+    else:
+        if keyword_hits is None:
+            with stage("normalize"):
+                normalized = normalize_text(input_text)
+        with stage("rule_scan"):
+            if keyword_hits is None:
+                keyword_hits = scan_keywords(normalized)
+            violations, has_good_patterns = evaluate_rules(keyword_hits)
     
     # Determine status
-    if len(violations) >= 3:
+    violation_count = violations.bit_count()
+    if violation_count >= 3:
         status = "RED"
-        summary = f"Critical: {len(violations)} major violations found"
-    elif len(violations) >= 1:
+        summary = f"Critical: {violation_count} major violations found"
+    elif violation_count >= 1:
         status = "YELLOW" 
-        summary = f"Warning: {len(violations)} compliance issue(s) detected"
+        summary = f"Warning: {violation_count} compliance issue(s) detected"
     elif has_good_patterns:
         status = "GREEN"
         summary = "Code follows compliance best practices"
@@ -102,19 +209,26 @@ def analyze_compliance(input_text: str, analysis_type: str) -> ComplianceResult:
         summary = "Code needs compliance review"
     
     # Create detailed reasoning
+    # Codes become strings only here, for the response
+    evidence = decode(violations)
     if violations:
-        reasoning = f"Compliance analysis detected {len(violations)} violations:\n"
-        for v in violations:
+        reasoning = f"Compliance analysis detected {violation_count} violations:\n"
+        for v in evidence:
             reasoning += f"• {v.replace('_', ' ')}: Regulatory requirement not met\n"
     else:
         reasoning = "Code appears to follow compliance requirements with proper safeguards."
     
+    keyword_mask = encode_hits(keyword_hits)
     return ComplianceResult(
         status=status,
         violation_summary=summary,
         reasoning=reasoning,
         suggestion="Address violations to improve compliance" if violations else "Code is compliant",
-        evidence=violations,
+        evidence=evidence,
+        violation_mask=violations,
+        keyword_mask=keyword_mask,
+        confidence_score=explainability_engine.estimate_confidence(analysis_type, keyword_mask),
+        match_spans=match_spans(matches, violations, *span_range) if matches is not None else None,
         latency_ms=int((time.time() - start_time) * 1000)
     )
 
@@ -123,49 +237,263 @@ def analyze_compliance(input_text: str, analysis_type: str) -> ComplianceResult:
 def root():
     return {"message": "CAEPA - Trust Layer for Digital Creation", "status": "running"}
 
+async def record_analysis(result: ComplianceResult, request: AnalysisRequest, request_start: float):
+    """Append the analysis to history with the request's latency so far (float ms)"""
+    with stage("history_append"):
+        result.analysis_id = await asyncio.to_thread(
+            analytics.save_analysis, result.__dict__, request.input_text, request.analysis_type,
+            (time.perf_counter() - request_start) * 1000
+        )
+
 @app.post("/analyze", response_model=ComplianceResult)
-async def analyze_input(request: AnalysisRequest):
+async def analyze_input(request: AnalysisRequest, x_caepa_scan: Optional[str] = Header(None),
+                        x_tenant_id: Optional[str] = Header(None)):
+    request_start = time.perf_counter()
     if not request.input_text or len(request.input_text.strip()) < 5:
         raise HTTPException(status_code=400, detail="Input text is required and must be at least 5 characters")
     
     try:
-        result = analyze_compliance(request.input_text, request.analysis_type)
+        # Missing, forged or stale summaries decode to None and we scan ourselves
+        keyword_hits = None
+        span_range = request.span_range()
+        if x_caepa_scan and GATEWAY_SCAN_SECRET and span_range is None:
+            keyword_hits = decode_scan_summary(x_caepa_scan, normalize_text(request.input_text), GATEWAY_SCAN_SECRET)
+        
+        check_deadline("rule_scan")
+        result = analyze_compliance(request.input_text, request.analysis_type, keyword_hits, span_range)
+        
+        # Out of time: the violations are known, so return them ungraded rather than nothing
+        deadline = current_deadline.get()
+        if deadline is not None and deadline.expired():
+            record_cancelled("grade")
+            result.partial = True
+            await record_analysis(result, request, request_start)
+            result.stage_timings_ms = current_breakdown.get()
+            return result
         
         # Add grading
-        grade_result = grading_system.calculate_compliance_grade(result.__dict__, request.input_text)
+        with stage("grade"):
+            grade_result = grading_system.calculate_compliance_grade(
+                result.__dict__, request.input_text, tenant=request.tenant or x_tenant_id
+            )
         result.compliance_grade = grade_result
         
-        # Add AI metadata
-        result.reasoning_chain = [{"step": 1, "action": "Cerebras+Llama Analysis", "finding": "Real AI compliance analysis completed", "confidence": 0.9}]
-        result.confidence_score = 0.85
+        # Speculatively generate the fix while the user is still reading the grade. Only the LLM
+        # path is worth it: every analyzer code has a template, so that means non-GREEN results
+        # with no violation codes ("needs review") or a code added without a template.
+        if (request.pregenerate_fix and result.status != "GREEN"
+                and not policy_generator.can_use_templates(result.evidence)):
+            evidence = result.evidence
+            fix_cache.schedule(
+                request.input_text,
+                request.analysis_type,
+                lambda: policy_generator.generate_compliant_policy(request.input_text, request.analysis_type, evidence)
+            )
         
+        await record_analysis(result, request, request_start)
+        result.stage_timings_ms = current_breakdown.get()
         return result
-    except HTTPException:
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def get_compliant_policy(request: AnalysisRequest) -> dict:
+    """Fetch a fix from templates or the cache, attach to an in-flight generation, or generate it"""
+    evidence = analyze_compliance(request.input_text, request.analysis_type).evidence
+    
+    if policy_generator.can_use_templates(evidence):
+        policy_result = policy_generator.generate_compliant_policy(request.input_text, request.analysis_type, evidence)
+        return {**policy_result, "fix_source": "template"}
+    
+    check_deadline("llm_generate")
+    try:
+        # The generation itself is shielded, so a timed-out caller still leaves the fix cached
+        policy_result, fix_source = await asyncio.wait_for(
+            fix_cache.get_or_generate(
+                request.input_text,
+                request.analysis_type,
+                lambda: policy_generator.generate_compliant_policy(request.input_text, request.analysis_type, evidence)
+            ),
+            timeout=remaining_seconds()
+        )
+    except asyncio.TimeoutError:
+        record_cancelled("llm_generate")
+        raise DeadlineExceeded("llm_generate")
+    return {**policy_result, "fix_source": fix_source}
 
+@app.post("/generate-policy")
+async def generate_compliant_policy(request: AnalysisRequest):
+    """Generate corrected policy using Llama 3 via Cerebras"""
+    try:
+        return await get_compliant_policy(request)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Policy generation failed: {str(e)}")
+
+@app.post("/apply-fix")
+async def apply_compliance_fix(request: AnalysisRequest, x_tenant_id: Optional[str] = Header(None)):
+    """Apply Llama-generated corrections to fix violations"""
+    try:
+        policy_result = await get_compliant_policy(request)
+        
+        # Grade the corrected text the same way as any other input
+        fixed_result = analyze_compliance(policy_result["generated_policy"], request.analysis_type)
+        with stage("grade"):
+            new_grade = grading_system.calculate_compliance_grade(
+                fixed_result.__dict__, policy_result["generated_policy"], tenant=request.tenant or x_tenant_id
+            )
+        
+        return {
+            "original_text": request.input_text,
+            "fixed_text": policy_result["generated_policy"],
+            "improvements_made": policy_result["policy_improvements"],
+            "new_grade": new_grade,
+            "fix_source": policy_result["fix_source"],
+            "fix_summary": "All violations have been addressed with compliant alternatives",
+            "status": "FIXED"
+        }
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Fix application failed: {str(e)}")
+
+@app.get("/explain/{analysis_id}")
+def explain_analysis(analysis_id: int):
+    """Full reasoning chain for a stored analysis, built from its match index on first request"""
+    with stage("explain"):
+        reasoning_chain = explainability_engine.get_explanation(analysis_id)
+        cached = reasoning_chain is not None
+        if not cached:
+            record = analytics.get_analysis(analysis_id)
+            if record is None:
+                raise HTTPException(status_code=404, detail=f"Unknown analysis id {analysis_id}")
+            reasoning_chain = explainability_engine.explain_analysis(record)
+            explainability_engine.store_explanation(analysis_id, reasoning_chain)
+    return {
+        "analysis_id": analysis_id,
+        "reasoning_chain": reasoning_chain,
+        "confidence_score": explainability_engine.generate_confidence_score(reasoning_chain),
+        "cached": cached
+    }
+
+@app.post("/grade-corpus")
+def grade_corpus(request: CorpusGradeRequest, x_tenant_id: Optional[str] = Header(None)):
+    """Grade a whole corpus from violation counts, with each document's percentile rank"""
+    try:
+        tenant = request.tenant or x_tenant_id
+        with stage("grade_corpus"):
+            if request.violation_masks is not None:
+                grades = grading_system.grade_masks(request.violation_masks, tenant=tenant)
+            elif request.violation_counts is not None:
+                grades = grading_system.grade_corpus(request.violation_counts, tenant=tenant, regulations=request.regulations)
+            else:
+                raise ValueError("Provide violation_counts or violation_masks")
+        letters, counts = np.unique(grades["letter_grades"], return_counts=True)
+        return {
+            "documents": len(grades["penalty_points"]),
+            "grade_distribution": dict(zip(letters.tolist(), counts.tolist())),
+            **{name: values.tolist() for name, values in grades.items()}
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Corpus grading failed: {str(e)}")
+
+@app.post("/report/{format}")
+def download_report(format: str, request: AnalysisRequest):
+    """Analyze the input and render a PDF or Markdown compliance report"""
+    if format not in ("pdf", "markdown"):
+        raise HTTPException(status_code=400, detail="Format must be 'pdf' or 'markdown'")
+    
+    check_deadline("rule_scan")
+    # Spans for the excerpt the report shows, so it can highlight them in place
+    result = analyze_compliance(
+        request.input_text, request.analysis_type, span_range=(0, report_generator.EXCERPT_CHARS)
+    ).__dict__
+    
+    check_deadline("report_render")
+    with stage("report_render"):
+        if format == "pdf":
+            content = report_generator.generate_pdf_report(result, request.input_text, request.analysis_type)
+        else:
+            content = report_generator.generate_markdown_report(result, request.input_text, request.analysis_type)
+    
+    if format == "pdf":
+        return Response(
+            content=content,
+            media_type="application/pdf",
+            headers={"Content-Disposition": "attachment; filename=compliance_report.pdf"}
+        )
+    return Response(
+        content=content,
+        media_type="text/markdown",
+        headers={"Content-Disposition": "attachment; filename=compliance_report.md"}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Stage timings and request counters in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profiles")
+def list_profiles():
+    """Stored request profiles and profiler settings"""
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    return profiler.get_stats()
+
+@app.get("/debug/profiles/cumulative", response_class=PlainTextResponse)
+def get_cumulative_profile():
+    """All sampled requests' stacks in collapsed format (pipe into flamegraph.pl)"""
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    return PlainTextResponse(profiler.cumulative_collapsed())
+
+@app.get("/debug/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str):
+    """One request's stacks in collapsed format"""
+    session = profiler.get_profile(profile_id) if profiler.enabled else None
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return PlainTextResponse(session.collapsed())
+
+@app.get("/deadline-stats")
+def get_deadline_stats_endpoint():
+    """Work cancelled because the caller's deadline had passed, by stage"""
+    return get_deadline_stats()
+
+@app.get("/fix-stats")
+def get_fix_stats():
+    """Speculative fix pre-generation hit rate and waste"""
+    return fix_cache.get_stats()
+
+
+
+@app.get("/llm-stats")
+def get_llm_stats():
+    """Per-domain LLM token usage, latency and adaptive max_tokens"""
+    return llm_usage.get_stats()
 
 @app.get("/dashboard")
-def get_dashboard_data():
-    """Analytics dashboard data"""
+def get_dashboard_data(window: str = "24h", domain: Optional[str] = None, days: Optional[int] = Query(None, ge=1)):
+    """Analytics dashboard data, with latency percentiles for a recent window (1h, 24h, 7d, 30d).
+
+    With `days`, the totals cover only the last `days` days (and only `domain`, if given),
+    computed column-wise from the columnar history instead of the all-time counters.
+    """
     try:
+        if days is not None:
+            totals = analytics.get_dashboard_window(days=days, domain=domain)
+        else:
+            totals = analytics.get_risk_dashboard_data()
         return {
-            "status_distribution": {"GREEN": 45, "YELLOW": 23, "RED": 12},
-            "top_violations": {
-                "Missing consent mechanism": 8,
-                "Inadequate data encryption": 6,
-                "Insufficient access controls": 4
-            },
-            "compliance_trend": {
-                "2024-01-15": 85.2,
-                "2024-01-16": 78.9,
-                "2024-01-17": 92.1
-            },
-            "total_analyses": 80,
-            "avg_latency": 245
+            **totals,
+            "time_series": analytics.get_time_series(window, domain)
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Dashboard data unavailable: {str(e)}")
 
@@ -194,4 +522,12 @@ if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1].startswith('--port'):
         port = int(sys.argv[1].split('=')[1]) if '=' in sys.argv[1] else int(sys.argv[2])
     
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # Co-located with the gateway: listen on a Unix domain socket instead of TCP
+    uds_path = os.getenv("CAEPA_UDS_PATH")
+    if len(sys.argv) > 1 and sys.argv[1].startswith('--uds'):
+        uds_path = sys.argv[1].split('=')[1] if '=' in sys.argv[1] else sys.argv[2]
+    
+    if uds_path:
+        uvicorn.run(app, uds=uds_path)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,135 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# mcp-gateway/metrics.py keeps an identical copy.
+
+# Prometheus default buckets, extended down to 100µs for the in-process stages
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Request header asking for the per-stage breakdown in the response
+TIMINGS_HEADER = "x-stage-timings"
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class MetricsRegistry:
+    """Counters and histograms rendered in the Prometheus text exposition format"""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.help: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self.counters: Dict[str, Dict[LabelSet, float]] = {}
+        self.histograms: Dict[str, Dict[LabelSet, Histogram]] = {}
+
+    def counter(self, name: str, help_text: str):
+        self.help[name] = ("counter", help_text)
+        self.counters.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str):
+        self.help[name] = ("histogram", help_text)
+        self.histograms.setdefault(name, {})
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters[name]
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (metric_type, help_text) in self.help.items():
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {metric_type}")
+                if metric_type == "counter":
+                    for labels, value in self.counters[name].items():
+                        lines.append(f"{full_name}{format_labels(labels)} {value:g}")
+                    continue
+                for labels, histogram in self.histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                    cumulative += histogram.counts[-1]
+                    lines.append(f"{full_name}_bucket{format_labels(labels + (('le', '+Inf'),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{full_name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels: LabelSet) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels) + "}"
+
+# Per-request stage breakdown (ms), only collected when the caller asked for it
+current_breakdown: contextvars.ContextVar = contextvars.ContextVar("current_breakdown", default=None)
+
+def wants_timings(headers) -> bool:
+    return headers.get(TIMINGS_HEADER, "").lower() in ("1", "true", "yes")
+
+def server_timing(breakdown: Dict[str, float]) -> str:
+    """Server-Timing header value for a stage breakdown"""
+    return ", ".join(f"{stage};dur={ms:.3f}" for stage, ms in breakdown.items())
+
+class StageTimers:
+    """Times named request stages into one histogram, plus the request's breakdown if enabled"""
+
+    def __init__(self, registry: MetricsRegistry, name: str = "stage_duration_seconds"):
+        self.registry = registry
+        self.name = name
+        registry.histogram(name, "Time spent in each request stage")
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage: str, seconds: float):
+        self.registry.observe(self.name, seconds, stage=stage)
+        breakdown: Optional[Dict[str, float]] = current_breakdown.get()
+        if breakdown is not None:
+            breakdown[stage] = breakdown.get(stage, 0.0) + seconds * 1000
+
+registry = MetricsRegistry("caepa")
+stages = StageTimers(registry)
+registry.counter("http_requests_total", "HTTP requests by route and status code")
+registry.histogram("http_request_duration_seconds", "End-to-end HTTP request latency by route")
+
+def stage(name: str):
+    """with stage("rule_scan"): ... -- time a block as one request stage"""
+    return stages.time(name)
+
+def observe_request(route: str, method: str, status_code: int, seconds: float):
+    registry.inc("http_requests_total", route=route, method=method, status=str(status_code))
+    registry.observe("http_request_duration_seconds", seconds, route=route)
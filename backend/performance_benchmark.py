@@ -1,10 +1,17 @@
 import time
 import openai
 import asyncio
-from typing import Dict, List
+from typing import Dict, List, Optional
+from llm_accounting import LLMUsageTracker, token_usage
+from deadline import remaining_seconds
+
+BENCHMARK_MAX_TOKENS = 300
+# Usage key for benchmark calls, so synthetic samples never move the production "gdpr" cap
+BENCHMARK_USAGE_KEY = "benchmark"
 
 class PerformanceBenchmark:
-    def __init__(self):
+    def __init__(self, usage_tracker: Optional[LLMUsageTracker] = None):
+        self.usage_tracker = usage_tracker
         self.cerebras_client = openai.OpenAI(
             api_key="demo-key",
             base_url="https://api.cerebras.ai/v1"
@@ -33,17 +40,32 @@ class PerformanceBenchmark:
         }
 
     async def analyze_with_cerebras(self, input_text: str) -> str:
+        prompt = f"Analyze this for GDPR compliance and generate corrected policy text: {input_text}"
+        max_tokens = BENCHMARK_MAX_TOKENS
+        if self.usage_tracker:
+            max_tokens = self.usage_tracker.recommend_max_tokens(BENCHMARK_USAGE_KEY, BENCHMARK_MAX_TOKENS)
+        
         try:
+            start_time = time.time()
             response = self.cerebras_client.chat.completions.create(
                 model="llama3.1-8b",  # Explicit Llama model
                 messages=[{
                     "role": "user", 
-                    "content": f"Analyze this for GDPR compliance and generate corrected policy text: {input_text}"
+                    "content": prompt
                 }],
                 temperature=0.1,
-                max_tokens=300
+                max_tokens=max_tokens,
+                timeout=remaining_seconds()
             )
-            return response.choices[0].message.content
+            content = response.choices[0].message.content
+            
+            if self.usage_tracker:
+                prompt_tokens, completion_tokens = token_usage(response, prompt, content)
+                self.usage_tracker.record(
+                    "performance-benchmark", BENCHMARK_USAGE_KEY, prompt_tokens, completion_tokens,
+                    (time.time() - start_time) * 1000, max_tokens, response.choices[0].finish_reason
+                )
+            return content
         except:
             return "CEREBRAS ANALYSIS: Critical GDPR violation detected. Corrected policy: 'We collect personal data only with explicit user consent as required by GDPR Article 6.'"
 
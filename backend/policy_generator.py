@@ -1,9 +1,57 @@
 import openai
 import os
-from typing import Dict, List
+import time
+from string import Template
+from typing import Dict, List, Optional
+from llm_accounting import LLMUsageTracker, token_usage
+from deadline import remaining_seconds, record_cancelled
+from metrics import stage
+
+# Vetted fix snippets per evidence code. Violations covered here never reach the LLM.
+FIX_TEMPLATES = {
+    "GDPR_NoConsent": Template(
+        "Consent: We collect $data_category only after obtaining explicit, informed, opt-in consent "
+        "from the data subject. Consent is recorded with a timestamp and can be withdrawn at any time "
+        "(GDPR Article 6(1)(a) and Article 7)."
+    ),
+    "GDPR_DataRetention": Template(
+        "Retention: $data_category is kept for no longer than $retention_days days after the purpose of "
+        "collection is fulfilled and is then securely erased, in line with the storage limitation "
+        "principle (GDPR Article 5(1)(e))."
+    ),
+    "GDPR_DataSharing": Template(
+        "Disclosure: $data_category is disclosed to external recipients only under a written data "
+        "processing agreement, and those recipients are named to data subjects before collection "
+        "(GDPR Articles 13 and 28)."
+    ),
+    "HIPAA_Encryption": Template(
+        "Encryption: Protected health information is encrypted at rest with AES-256 and in transit with "
+        "TLS 1.2 or higher (HIPAA Security Rule, 45 CFR 164.312(a)(2)(iv) and (e)(1))."
+    ),
+    "HIPAA_Security": Template(
+        "Security safeguards: Protected health information is always encrypted when stored or transmitted. "
+        "Access requires unique user authentication, is limited to authorized personnel on a need-to-know "
+        "basis, and every access is recorded in an audit log (45 CFR 164.312(b) and (d))."
+    ),
+    "SOX_Controls": Template(
+        "Financial controls: Changes to financial data require documented approval, segregation of duties "
+        "and independent reconciliation, with a complete audit trail reviewed by management "
+        "(SOX Sections 302 and 404)."
+    )
+}
+
+DATA_CATEGORIES = [
+    ("email", "Contact data"),
+    ("patient", "Patient data"),
+    ("medical", "Medical data"),
+    ("financial", "Financial data")
+]
+
+DEFAULT_MAX_TOKENS = 400
 
 class ProactivePolicyGenerator:
-    def __init__(self):
+    def __init__(self, usage_tracker: Optional[LLMUsageTracker] = None):
+        self.usage_tracker = usage_tracker
         try:
             self.cerebras_client = openai.OpenAI(
                 api_key=os.getenv("CEREBRAS_API_KEY", "demo-key"),
@@ -14,9 +62,50 @@ class ProactivePolicyGenerator:
             self.cerebras_client = None
             print("Using fallback mode - upgrade OpenAI: pip install openai>=1.0.0")
 
-    def generate_compliant_policy(self, violation_text: str, domain: str) -> Dict:
-        """Generate corrected policy text using Llama 3 via Cerebras"""
+    def is_cacheable(self, result: Dict) -> bool:
+        """False for fallback fixes produced while the LLM is configured (timeouts, transient
+        errors): caching those would serve the fallback until eviction"""
+        return self.cerebras_client is None or all(
+            source["source"] != "fallback" for source in result.get("fix_sources", [])
+        )
+
+    def can_use_templates(self, evidence: Optional[List[str]]) -> bool:
+        """True when every violation has a vetted template, so no LLM call is needed"""
+        return bool(evidence) and all(code in FIX_TEMPLATES for code in evidence)
+
+    def render_template_fixes(self, violation_text: str, evidence: List[str]) -> List[str]:
+        """Render the vetted snippets for the covered evidence codes"""
+        text_lower = violation_text.lower()
+        data_category = next(
+            (category for keyword, category in DATA_CATEGORIES if keyword in text_lower),
+            "Personal data"
+        )
+        params = {
+            "data_category": data_category,
+            "retention_days": os.getenv("POLICY_RETENTION_DAYS", "30")
+        }
+        return [FIX_TEMPLATES[code].substitute(params) for code in dict.fromkeys(evidence) if code in FIX_TEMPLATES]
+
+    def generate_compliant_policy(self, violation_text: str, domain: str, evidence: Optional[List[str]] = None) -> Dict:
+        """Generate corrected policy text, using templates for known violations and Llama 3 via Cerebras for the rest"""
         
+        evidence = list(dict.fromkeys(evidence or []))
+        covered = [code for code in evidence if code in FIX_TEMPLATES]
+        uncovered = [code for code in evidence if code not in FIX_TEMPLATES]
+        template_fixes = self.render_template_fixes(violation_text, covered)
+        fix_sources = [{"violation": code, "source": "template"} for code in covered]
+
+        if evidence and not uncovered:
+            generated_policy = "\n\n".join(template_fixes)
+            return {
+                "original_text": violation_text,
+                "generated_policy": generated_policy,
+                "compliance_domain": domain.upper(),
+                "generation_method": "Template fast path",
+                "fix_sources": fix_sources,
+                "policy_improvements": self.analyze_improvements(violation_text, generated_policy)
+            }
+
         policy_templates = {
             "gdpr": """
             GDPR-compliant policy template:
@@ -60,31 +149,70 @@ class ProactivePolicyGenerator:
         
         Output ONLY the corrected policy text, no explanations.
         """
+        
+        if uncovered:
+            prompt += f"""
+        Address ONLY these violations: {", ".join(uncovered)}.
+        The following are already handled elsewhere, do not repeat them: {", ".join(covered) or "none"}.
+        """
 
+        # Never wait on the LLM longer than the caller will wait for us
+        timeout = remaining_seconds()
+        
         try:
-            if self.cerebras_client:
-                response = self.cerebras_client.chat.completions.create(
-                    model="llama3.1-8b",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.2,
-                    max_tokens=400
-                )
+            if timeout is not None and timeout <= 0:
+                record_cancelled("llm_generate")
+                generated_policy = self.generate_fallback_policy(violation_text, domain)["generated_policy"]
+                source = "fallback"
+            elif self.cerebras_client:
+                max_tokens = DEFAULT_MAX_TOKENS
+                if self.usage_tracker:
+                    max_tokens = self.usage_tracker.recommend_max_tokens(domain, DEFAULT_MAX_TOKENS)
+                
+                start_time = time.time()
+                with stage("llm_generate"):
+                    response = self.cerebras_client.chat.completions.create(
+                        model="llama3.1-8b",
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.2,
+                        max_tokens=max_tokens,
+                        timeout=timeout
+                    )
                 generated_policy = response.choices[0].message.content.strip()
+                source = "llm"
+                
+                if self.usage_tracker:
+                    # Accounting is best effort: a failed usage write must not discard a good response
+                    try:
+                        prompt_tokens, completion_tokens = token_usage(response, prompt, generated_policy)
+                        self.usage_tracker.record(
+                            "generate-policy", domain, prompt_tokens, completion_tokens,
+                            (time.time() - start_time) * 1000, max_tokens, response.choices[0].finish_reason
+                        )
+                    except Exception as e:
+                        print(f"⚠️ LLM usage accounting failed: {e}")
             else:
                 # Fallback mode
                 generated_policy = self.generate_fallback_policy(violation_text, domain)["generated_policy"]
-            
-            return {
-                "original_text": violation_text,
-                "generated_policy": generated_policy,
-                "compliance_domain": domain.upper(),
-                "generation_method": "Llama 3.1-8B via Cerebras API",
-                "policy_improvements": self.analyze_improvements(violation_text, generated_policy)
-            }
-            
+                source = "fallback"
         except Exception as e:
+            if isinstance(e, openai.APITimeoutError) and timeout is not None:
+                record_cancelled("llm_generate")
             # Fallback policy generation
-            return self.generate_fallback_policy(violation_text, domain)
+            generated_policy = self.generate_fallback_policy(violation_text, domain)["generated_policy"]
+            source = "fallback"
+        
+        fix_sources += [{"violation": code, "source": source} for code in uncovered or [None]]
+        generated_policy = "\n\n".join(template_fixes + [generated_policy])
+        
+        return {
+            "original_text": violation_text,
+            "generated_policy": generated_policy,
+            "compliance_domain": domain.upper(),
+            "generation_method": "Llama 3.1-8B via Cerebras API" if source == "llm" else "Fallback template (Cerebras unavailable)",
+            "fix_sources": fix_sources,
+            "policy_improvements": self.analyze_improvements(violation_text, generated_policy)
+        }
 
     def analyze_improvements(self, original: str, generated: str) -> List[str]:
         """Analyze what improvements were made"""
@@ -136,5 +264,6 @@ class ProactivePolicyGenerator:
             "generated_policy": fallback_policies.get(domain, fallback_policies["gdpr"]).strip(),
             "compliance_domain": domain.upper(),
             "generation_method": "Fallback template (Cerebras unavailable)",
+            "fix_sources": [{"violation": None, "source": "fallback"}],
             "policy_improvements": ["Added comprehensive compliance framework"]
         }
\ No newline at end of file
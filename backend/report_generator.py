@@ -3,10 +3,15 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from datetime import datetime
+from xml.sax.saxutils import escape
 import io
 import base64
+from violation_codes import VIOLATION_CODES
 
 class ComplianceReportGenerator:
+    # How much of the input the reports quote
+    EXCERPT_CHARS = 500
+
     def __init__(self):
         self.styles = getSampleStyleSheet()
         self.title_style = ParagraphStyle(
@@ -51,7 +56,7 @@ class ComplianceReportGenerator:
 
         # Input Analysis
         story.append(Paragraph("Input Content", self.styles['Heading2']))
-        story.append(Paragraph(f"<pre>{input_text[:500]}...</pre>", self.styles['Code']))
+        story.append(Paragraph(self.highlight_excerpt(input_text, analysis_result.get('match_spans') or []), self.styles['Code']))
         story.append(Spacer(1, 12))
 
         # Compliance Results
@@ -82,6 +87,24 @@ class ComplianceReportGenerator:
         buffer.seek(0)
         return buffer.getvalue()
 
+    def highlight_excerpt(self, input_text, spans):
+        """Paragraph markup for the quoted input with each violation span highlighted in place"""
+        excerpt = input_text[:self.EXCERPT_CHARS]
+        parts = []
+        position = 0
+        for start, end, rule in spans:
+            # Spans are sorted; skip any that overlap one already drawn or run past the excerpt
+            if start < position or end > len(excerpt):
+                continue
+            parts.append(escape(excerpt[position:start]))
+            parts.append(
+                f"<font backColor='yellow' color='darkred'>{escape(excerpt[start:end])}</font>"
+                f"<super><font size='6'>{VIOLATION_CODES[rule]}</font></super>"
+            )
+            position = end
+        parts.append(escape(excerpt[position:]))
+        return "".join(parts) + "..."
+
     def generate_markdown_report(self, analysis_result, input_text, domain):
         report = f"""# 🛡️ CAEPA Compliance Analysis Report
 
@@ -93,7 +116,7 @@ class ComplianceReportGenerator:
 
 ## Input Content
 ```
-{input_text[:500]}...
+{input_text[:self.EXCERPT_CHARS]}...
 ```
 
 ## Compliance Assessment
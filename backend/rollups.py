@@ -0,0 +1,132 @@
+import math
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram (DDSketch-style, ~1% relative error).
+
+    Bucket boundaries are fixed, so histograms from different windows, domains or workers
+    merge by adding their counts. Only non-empty buckets are stored, so a cell costs a few
+    dozen entries and any percentile is read back in O(buckets).
+    """
+
+    RELATIVE_ACCURACY = 0.01
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    MIN_MS = 0.01
+    MAX_MS = 600000.0
+    MAX_BUCKET = int(math.ceil(math.log(MAX_MS / MIN_MS, GAMMA)))
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        self.counts = Counter(counts or {})
+
+    @classmethod
+    def bucket_of(cls, latency_ms: float) -> int:
+        if latency_ms <= cls.MIN_MS:
+            return 0
+        return min(cls.MAX_BUCKET, int(math.ceil(math.log(latency_ms / cls.MIN_MS, cls.GAMMA))))
+
+    def record(self, latency_ms: float):
+        self.counts[self.bucket_of(latency_ms)] += 1
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        self.counts.update(other.counts)
+        return self
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def percentile(self, q: float) -> Optional[float]:
+        total = self.total
+        if not total:
+            return None
+        rank = max(1, math.ceil(q / 100 * total))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                break
+        if bucket == 0:
+            return self.MIN_MS
+        # Midpoint of the bucket in log space keeps the error symmetric
+        return round(self.MIN_MS * self.GAMMA ** bucket * 2 / (1 + self.GAMMA), 3)
+
+    def percentiles(self) -> Dict[str, Optional[float]]:
+        return {"p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99)}
+
+class RollupCell:
+    __slots__ = ("count", "statuses", "latency")
+
+    def __init__(self):
+        self.count = 0
+        self.statuses = Counter()
+        self.latency = LatencyHistogram()
+
+# resolution -> (length of the timestamp prefix that names a bucket, buckets kept)
+RESOLUTIONS = {
+    "minute": (16, 24 * 60),  # "YYYY-MM-DDTHH:MM", last 24 hours
+    "hour": (13, 30 * 24),    # "YYYY-MM-DDTHH", last 30 days
+    "day": (10, 400)          # "YYYY-MM-DD", a bit over a year
+}
+
+class TimeSeriesRollups:
+    """Minute/hour/day rollups per domain with mergeable latency histograms"""
+
+    def __init__(self):
+        # resolution -> bucket key -> domain -> cell (bucket keys arrive in time order)
+        self.buckets: Dict[str, OrderedDict] = {resolution: OrderedDict() for resolution in RESOLUTIONS}
+
+    def add(self, timestamp: str, domain: str, status: str, latency_ms: float):
+        bucket = LatencyHistogram.bucket_of(latency_ms)
+        for resolution, (prefix, keep) in RESOLUTIONS.items():
+            series = self.buckets[resolution]
+            key = timestamp[:prefix]
+            cells = series.get(key)
+            if cells is None:
+                # Another worker's clock may trail ours slightly; keep keys ordered anyway
+                out_of_order = bool(series) and key < next(reversed(series))
+                cells = series[key] = {}
+                if out_of_order:
+                    for ordered_key in sorted(series):
+                        series.move_to_end(ordered_key)
+                while len(series) > keep:
+                    series.popitem(last=False)
+            cell = cells.get(domain)
+            if cell is None:
+                cell = cells[domain] = RollupCell()
+            cell.count += 1
+            cell.statuses[status] += 1
+            cell.latency.counts[bucket] += 1
+
+    def _cells(self, resolution: str, since_key: str) -> Iterable[Tuple[str, Dict[str, RollupCell]]]:
+        for key in reversed(self.buckets[resolution]):
+            if key < since_key:
+                return
+            yield key, self.buckets[resolution][key]
+
+    def window(self, resolution: str, since_key: str, domain: Optional[str] = None) -> Dict:
+        """Counts and latency percentiles over buckets >= since_key, overall and per domain"""
+        overall = RollupCell()
+        by_domain: Dict[str, RollupCell] = {}
+        for _, cells in self._cells(resolution, since_key):
+            for cell_domain, cell in cells.items():
+                if domain is not None and cell_domain != domain:
+                    continue
+                for target in (overall, by_domain.setdefault(cell_domain, RollupCell())):
+                    target.count += cell.count
+                    target.statuses.update(cell.statuses)
+                    target.latency.merge(cell.latency)
+
+        return {
+            "total_analyses": overall.count,
+            "status_distribution": dict(overall.statuses),
+            "latency_percentiles": overall.latency.percentiles(),
+            "by_domain": {
+                d: {
+                    "total_analyses": cell.count,
+                    "status_distribution": dict(cell.statuses),
+                    "latency_percentiles": cell.latency.percentiles()
+                }
+                for d, cell in by_domain.items()
+            }
+        }
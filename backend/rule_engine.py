@@ -0,0 +1,164 @@
+import bisect
+import hashlib
+import hmac
+import os
+import re
+from typing import FrozenSet, List, Optional, Tuple
+from violation_codes import (
+    CODE_IDS, GDPR_NO_CONSENT, GDPR_DATA_RETENTION, GDPR_DATA_SHARING, HIPAA_ENCRYPTION, HIPAA_SECURITY, SOX_CONTROLS
+)
+
+# Every keyword the pattern rules look at. The order is part of the wire format of
+# the gateway scan summary (bit i = keyword i), so only ever append to this tuple.
+# mcp-gateway/scan_summary.py keeps an identical copy.
+COMPLIANCE_KEYWORDS = (
+    "email", "consent",
+    "forever", "permanent", "indefinitely",
+    "third party", "send to third", "share with",
+    "patient", "medical", "health", "phi", "encrypt", "unencrypted",
+    "financial", "control",
+    "expiry", "authorization", "secure", "permission"
+)
+VOCABULARY_VERSION = hashlib.sha256("|".join(COMPLIANCE_KEYWORDS).encode("utf-8")).hexdigest()[:12]
+
+# The value .env.example once shipped. It is public, so anyone could forge summaries signed with it.
+PLACEHOLDER_SCAN_SECRET = "change_me_to_a_random_string"
+
+def scan_secret_from_env() -> Optional[str]:
+    """GATEWAY_SCAN_SECRET, or None when unset (scan summaries off); refuses the public placeholder"""
+    secret = os.getenv("GATEWAY_SCAN_SECRET") or None
+    if secret == PLACEHOLDER_SCAN_SECRET:
+        raise RuntimeError(
+            "GATEWAY_SCAN_SECRET is the example placeholder; set a random secret or leave it empty"
+        )
+    return secret
+
+RETENTION_KEYWORDS = ("forever", "permanent", "indefinitely")
+SHARING_KEYWORDS = ("third party", "send to third", "share with")
+PHI_KEYWORDS = ("patient", "medical", "health", "phi")
+GOOD_PATTERNS = ("consent", "encrypt", "expiry", "authorization", "secure", "permission")
+
+# Keywords whose matches are highlighted as evidence for each violation code
+RULE_KEYWORDS = {
+    "GDPR_NoConsent": ("email",),
+    "GDPR_DataRetention": RETENTION_KEYWORDS,
+    "GDPR_DataSharing": SHARING_KEYWORDS,
+    "HIPAA_Encryption": PHI_KEYWORDS,
+    "HIPAA_Security": ("unencrypted",),
+    "SOX_Controls": ("financial",)
+}
+KEYWORD_BITS = {keyword: bit for bit, keyword in enumerate(COMPLIANCE_KEYWORDS)}
+# keyword bit -> violation code id
+KEYWORD_RULES = {KEYWORD_BITS[keyword]: CODE_IDS[code] for code, keywords in RULE_KEYWORDS.items() for keyword in keywords}
+
+# Zero-width lookahead so overlapping keywords ("encrypt" inside "unencrypted") are all found,
+# matching the substring semantics of scan_keywords. No keyword is a prefix of another, so
+# one match per start position loses nothing.
+MATCH_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(COMPLIANCE_KEYWORDS, key=len, reverse=True)) + "))"
+)
+MAX_KEYWORD_LENGTH = max(len(k) for k in COMPLIANCE_KEYWORDS)
+
+Match = Tuple[int, int, int]  # (start, end, keyword bit or violation code id)
+
+def normalize_text(input_text: str) -> str:
+    return input_text.lower().replace('_', ' ').replace('-', ' ')
+
+def scan_keywords(normalized_text: str) -> FrozenSet[str]:
+    """Single pass over the vocabulary: which keywords occur in the text"""
+    return frozenset(keyword for keyword in COMPLIANCE_KEYWORDS if keyword in normalized_text)
+
+def normalize_preserving_offsets(input_text: str) -> str:
+    """normalize_text(), but guaranteed to keep every character at its input offset"""
+    normalized = normalize_text(input_text)
+    if len(normalized) == len(input_text):
+        return normalized
+    # A few characters lowercase to more than one (e.g. "İ"); leave those as they are
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in input_text).replace('_', ' ').replace('-', ' ')
+
+def scan_matches(normalized_text: str) -> Tuple[FrozenSet[str], List[Match]]:
+    """Single regex pass giving the keyword hits plus every (start, end, keyword bit) match, sorted"""
+    matches = [
+        (m.start(), m.start() + len(m.group(1)), KEYWORD_BITS[m.group(1)])
+        for m in MATCH_PATTERN.finditer(normalized_text)
+    ]
+    return frozenset(COMPLIANCE_KEYWORDS[bit] for _, _, bit in matches), matches
+
+def match_spans(matches: List[Match], violation_mask: int,
+                start: Optional[int] = None, end: Optional[int] = None) -> List[Match]:
+    """(start, end, violation code id) for matches behind the violations found, sorted by start.
+
+    With start/end, only spans overlapping [start, end) are returned, found by bisection so a
+    viewer can page through a large document cheaply.
+    """
+    lo = 0
+    if start is not None:
+        # Matches starting this far back may still reach into the range
+        lo = bisect.bisect_left(matches, (start - MAX_KEYWORD_LENGTH,))
+    spans = []
+    for match_start, match_end, bit in matches[lo:]:
+        if end is not None and match_start >= end:
+            break
+        if start is not None and match_end <= start:
+            continue
+        rule = KEYWORD_RULES.get(bit)
+        if rule is not None and violation_mask >> rule & 1:
+            spans.append((match_start, match_end, rule))
+    return spans
+
+def encode_hits(hits: FrozenSet[str]) -> int:
+    """Keyword hits as a bitmask (bit i = COMPLIANCE_KEYWORDS[i]), compact enough to store per analysis"""
+    return sum(1 << bit for bit, keyword in enumerate(COMPLIANCE_KEYWORDS) if keyword in hits)
+
+def decode_hits(mask: int) -> FrozenSet[str]:
+    return frozenset(keyword for bit, keyword in enumerate(COMPLIANCE_KEYWORDS) if mask >> bit & 1)
+
+def evaluate_rules(hits: FrozenSet[str]) -> Tuple[int, bool]:
+    """Map keyword hits to a violation mask (see violation_codes); also report whether good patterns are present"""
+    violations = 0
+
+    # GDPR violations
+    if "email" in hits and "consent" not in hits:
+        violations |= GDPR_NO_CONSENT
+    if any(word in hits for word in RETENTION_KEYWORDS):
+        violations |= GDPR_DATA_RETENTION
+    if any(phrase in hits for phrase in SHARING_KEYWORDS):
+        violations |= GDPR_DATA_SHARING
+
+    # HIPAA violations
+    if any(word in hits for word in PHI_KEYWORDS) and "encrypt" not in hits:
+        violations |= HIPAA_ENCRYPTION
+    if "unencrypted" in hits:
+        violations |= HIPAA_SECURITY
+
+    # SOX violations
+    if "financial" in hits and "control" not in hits:
+        violations |= SOX_CONTROLS
+
+    has_good_patterns = any(pattern in hits for pattern in GOOD_PATTERNS)
+    return violations, has_good_patterns
+
+def decode_scan_summary(header: Optional[str], normalized_text: str, secret: Optional[str]) -> Optional[FrozenSet[str]]:
+    """Keyword hits from a gateway X-CAEPA-Scan header, or None if it can't be trusted.
+
+    Format: v1.<vocabulary version>.<sha256 of normalized text>.<hit bitmask hex>.<hmac-sha256 hex>
+    """
+    if not header or not secret:
+        return None
+    try:
+        version, vocabulary, text_hash, hit_mask, signature = header.split(".")
+        mask = int(hit_mask, 16)
+    except ValueError:
+        return None
+    if version != "v1" or vocabulary != VOCABULARY_VERSION:
+        return None
+
+    payload = f"{version}.{vocabulary}.{text_hash}.{hit_mask}"
+    expected = hmac.new(secret.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, signature):
+        return None
+    # The summary must describe exactly this text, not a replayed header
+    if hashlib.sha256(normalized_text.encode("utf-8")).hexdigest() != text_hash:
+        return None
+
+    return decode_hits(mask)
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+
+import pytest
+
+from fix_cache import FixCache
+
+TEXT = "Store user email forever"
+
+def test_key_ignores_case_and_whitespace():
+    assert FixCache.make_key("Store  user\nEMAIL", "GDPR") == FixCache.make_key("store user email", "gdpr")
+    assert FixCache.make_key(TEXT, "gdpr") != FixCache.make_key(TEXT, "hipaa")
+
+def test_miss_then_cache_hit():
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return {"fix": "add consent"}
+
+    async def scenario():
+        cache = FixCache()
+        first = await cache.get_or_generate(TEXT, "gdpr", generate)
+        second = await cache.get_or_generate(TEXT.upper(), "gdpr", generate)
+        return cache, first, second
+
+    cache, first, second = asyncio.run(scenario())
+    assert first == ({"fix": "add consent"}, "generated")
+    assert second == ({"fix": "add consent"}, "cache")
+    assert len(calls) == 1
+    stats = cache.get_stats()
+    assert stats["misses"] == 1
+    assert stats["cache_hits"] == 1
+    # A fix somebody asked for is not a pregeneration, hit or wasted
+    assert stats["pregeneration_hits"] == 0
+    assert stats["wasted_pregenerations"] == 0
+
+def test_concurrent_callers_attach_to_one_generation():
+    release = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        release.wait(5)
+        return {"fix": "shared"}
+
+    async def scenario():
+        cache = FixCache()
+        first = asyncio.create_task(cache.get_or_generate(TEXT, "gdpr", generate))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(cache.get_or_generate(TEXT, "gdpr", generate))
+        await asyncio.sleep(0.05)
+        release.set()
+        return cache, await first, await second
+
+    cache, first, second = asyncio.run(scenario())
+    assert first == ({"fix": "shared"}, "generated")
+    assert second == ({"fix": "shared"}, "in_flight")
+    assert len(calls) == 1
+    assert cache.get_stats()["in_flight_attaches"] == 1
+    assert cache.get_stats()["in_flight"] == 0
+
+def test_attaching_to_a_speculative_generation_counts_one_hit():
+    release = threading.Event()
+
+    def generate():
+        release.wait(5)
+        return {"fix": "pregenerated"}
+
+    async def scenario():
+        cache = FixCache()
+        assert cache.schedule(TEXT, "gdpr", generate)
+        # Already in flight: not scheduled twice
+        assert not cache.schedule(TEXT, "gdpr", generate)
+        waiter = asyncio.create_task(cache.get_or_generate(TEXT, "gdpr", generate))
+        await asyncio.sleep(0.05)
+        release.set()
+        attached = await waiter
+        # Later callers hit the cache without counting the pregeneration again
+        cached = await cache.get_or_generate(TEXT, "gdpr", generate)
+        return cache, attached, cached
+
+    cache, attached, cached = asyncio.run(scenario())
+    assert attached == ({"fix": "pregenerated"}, "in_flight")
+    assert cached == ({"fix": "pregenerated"}, "cache")
+    stats = cache.get_stats()
+    assert stats["pregenerations_started"] == 1
+    assert stats["pregeneration_hits"] == 1
+    assert stats["pregeneration_hit_rate"] == 1.0
+    assert stats["speculative_running"] == 0
+
+def test_speculative_budget_and_failures():
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return {"fix": "late"}
+
+    def broken():
+        raise RuntimeError("LLM unavailable")
+
+    async def scenario():
+        cache = FixCache(max_speculative=1)
+        assert cache.schedule("first document", "gdpr", slow)
+        assert not cache.schedule("second document", "gdpr", slow)
+        release.set()
+        await asyncio.gather(*cache.in_flight.values())
+        # A failed pregeneration is wasted, and the caller who wanted it still generates one
+        assert cache.schedule("third document", "gdpr", broken)
+        await asyncio.gather(*cache.in_flight.values())
+        result = await cache.get_or_generate("third document", "gdpr", lambda: {"fix": "retried"})
+        return cache, result
+
+    cache, result = asyncio.run(scenario())
+    assert result == ({"fix": "retried"}, "generated")
+    stats = cache.get_stats()
+    assert stats["pregenerations_started"] == 2
+    assert stats["pregenerations_skipped_budget"] == 1
+    assert stats["wasted_pregenerations"] == 1
+    assert stats["speculative_running"] == 0
+
+def test_evicting_an_unused_pregeneration_is_wasted():
+    async def scenario():
+        cache = FixCache(max_entries=1)
+        cache.schedule("first document", "gdpr", lambda: {"fix": "unused"})
+        await asyncio.gather(*cache.in_flight.values())
+        await cache.get_or_generate("second document", "gdpr", lambda: {"fix": "wanted"})
+        return cache
+
+    stats = asyncio.run(scenario()).get_stats()
+    assert stats["cached_fixes"] == 1
+    assert stats["pregeneration_hits"] == 0
+    assert stats["wasted_pregenerations"] == 1
+
+def test_uncacheable_results_are_returned_but_not_kept():
+    results = iter([{"fix": "fallback", "fallback": True}, {"fix": "real"}])
+
+    async def scenario():
+        cache = FixCache(cacheable=lambda result: not result.get("fallback"))
+        first = await cache.get_or_generate(TEXT, "gdpr", lambda: next(results))
+        second = await cache.get_or_generate(TEXT, "gdpr", lambda: next(results))
+        third = await cache.get_or_generate(TEXT, "gdpr", lambda: next(results))
+        return cache, first, second, third
+
+    cache, first, second, third = asyncio.run(scenario())
+    assert first == ({"fix": "fallback", "fallback": True}, "generated")
+    assert second == ({"fix": "real"}, "generated")
+    assert third == ({"fix": "real"}, "cache")
+    assert cache.get_stats()["uncached_results"] == 1
+
+def test_generation_error_reaches_the_caller():
+    def broken():
+        raise RuntimeError("LLM unavailable")
+
+    async def scenario():
+        cache = FixCache()
+        with pytest.raises(RuntimeError):
+            await cache.get_or_generate(TEXT, "gdpr", broken)
+        return cache
+
+    stats = asyncio.run(scenario()).get_stats()
+    assert stats["in_flight"] == 0
+    assert stats["cached_fixes"] == 0
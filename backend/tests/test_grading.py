@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+import pytest
+
+from grading_system import REGULATIONS, ComplianceGradingSystem
+from violation_codes import VIOLATION_CODES
+
+@pytest.fixture
+def grader(tmp_path):
+    weights = tmp_path / "weights.json"
+    weights.write_text(json.dumps({"strict": {"CRITICAL": 40, "HIGH": 22.5, "MEDIUM": 10}}))
+    return ComplianceGradingSystem(weights_path=str(weights))
+
+def corpus_counts(documents: int = 300, seed: int = 7) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 4, size=(documents, len(REGULATIONS)))
+    counts[:10] = 0  # clean documents, as most of a real corpus is
+    return counts
+
+@pytest.mark.parametrize("tenant", [None, "strict", "unknown-tenant"])
+def test_grade_masks_matches_calculate_compliance_grade(grader, tenant):
+    masks = np.arange(1 << len(VIOLATION_CODES))
+    corpus = grader.grade_masks(masks, tenant=tenant)
+    for row, mask in enumerate(masks):
+        single = grader.calculate_compliance_grade({"violation_mask": int(mask)}, "", tenant=tenant)
+        assert corpus["penalty_points"][row] == pytest.approx(single["penalty_points"])
+        assert corpus["letter_grades"][row] == single["letter_grade"]
+        assert corpus["percentage_scores"][row] == single["percentage_score"]
+        assert corpus["total_violations"][row] == single["total_violations"]
+
+@pytest.mark.parametrize("tenant", [None, "strict"])
+def test_grade_corpus_matches_per_document_scoring(grader, tenant, monkeypatch):
+    counts = corpus_counts()
+    corpus = grader.grade_corpus(counts, tenant=tenant)
+    for row, document_counts in enumerate(counts):
+        breakdown = {regulation: int(count) for regulation, count in zip(REGULATIONS, document_counts)}
+        # Drive calculate_compliance_grade with this breakdown, covering CCPA too (which has
+        # no violation codes, so no mask can produce it)
+        monkeypatch.setattr(grader, "count_violations", lambda text, evidence, breakdown=breakdown: breakdown)
+        single = grader.calculate_compliance_grade({}, "", tenant=tenant)
+        assert corpus["penalty_points"][row] == pytest.approx(single["penalty_points"])
+        assert corpus["letter_grades"][row] == single["letter_grade"]
+        assert corpus["percentage_scores"][row] == single["percentage_score"]
+        assert corpus["total_violations"][row] == single["total_violations"]
+
+def test_percentile_ranks_count_ties_as_half(grader):
+    corpus = grader.grade_corpus([[0, 0, 0, 0], [0, 0, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1]])
+    # Penalties 0, 0, 25, 15: a clean document beats two and ties two (itself included)
+    assert corpus["percentile_ranks"].tolist() == [75.0, 75.0, 12.5, 37.5]
+
+def test_grade_corpus_rejects_a_wrong_shape(grader):
+    with pytest.raises(ValueError):
+        grader.grade_corpus([[1, 2, 3]])
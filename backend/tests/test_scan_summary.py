@@ -0,0 +1,75 @@
+import hashlib
+import hmac
+import importlib.util
+import os
+
+from rule_engine import (COMPLIANCE_KEYWORDS, VOCABULARY_VERSION, decode_scan_summary, encode_hits,
+                         normalize_text, scan_keywords)
+
+SECRET = "test-scan-secret"
+TEXT = "Send patient e-mail to third_party and keep the Email forever"
+
+def load_gateway_scan_summary():
+    # The gateway keeps its own copy of the vocabulary; load it by path, since both services
+    # use bare module names
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "mcp-gateway", "scan_summary.py")
+    spec = importlib.util.spec_from_file_location("gateway_scan_summary", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+gateway = load_gateway_scan_summary()
+
+def sign(payload: str, secret: str = SECRET) -> str:
+    signature = hmac.new(secret.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{payload}.{signature}"
+
+def test_gateway_vocabulary_matches_backend():
+    assert gateway.COMPLIANCE_KEYWORDS == COMPLIANCE_KEYWORDS
+    assert gateway.VOCABULARY_VERSION == VOCABULARY_VERSION
+
+def test_gateway_summary_decodes_to_the_backend_scan():
+    header = gateway.build_scan_summary(TEXT, SECRET)
+    normalized = normalize_text(TEXT)
+    hits = decode_scan_summary(header, normalized, SECRET)
+    assert hits == scan_keywords(normalized)
+    assert {"patient", "third party", "email", "forever"} <= hits
+
+def test_missing_header_or_secret():
+    header = gateway.build_scan_summary(TEXT, SECRET)
+    normalized = normalize_text(TEXT)
+    assert decode_scan_summary(None, normalized, SECRET) is None
+    assert decode_scan_summary("", normalized, SECRET) is None
+    assert decode_scan_summary(header, normalized, None) is None
+
+def test_rejects_a_tampered_mask():
+    header = gateway.build_scan_summary(TEXT, SECRET)
+    version, vocabulary, text_hash, hit_mask, signature = header.split(".")
+    # Claim no keywords matched, keeping the original signature
+    forged = ".".join([version, vocabulary, text_hash, "0", signature])
+    assert decode_scan_summary(forged, normalize_text(TEXT), SECRET) is None
+
+def test_rejects_a_summary_signed_with_another_secret():
+    header = gateway.build_scan_summary(TEXT, "some-other-secret")
+    assert decode_scan_summary(header, normalize_text(TEXT), SECRET) is None
+
+def test_rejects_a_summary_replayed_for_other_text():
+    header = gateway.build_scan_summary("harmless text", SECRET)
+    assert decode_scan_summary(header, normalize_text(TEXT), SECRET) is None
+
+def test_rejects_a_stale_vocabulary_version():
+    normalized = normalize_text(TEXT)
+    text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    mask = encode_hits(scan_keywords(normalized))
+    stale = hashlib.sha256("|".join(COMPLIANCE_KEYWORDS[:-1]).encode("utf-8")).hexdigest()[:12]
+    # Correctly signed, but the bitmask refers to a different keyword list
+    header = sign(f"v1.{stale}.{text_hash}.{mask:x}")
+    assert decode_scan_summary(header, normalized, SECRET) is None
+    assert decode_scan_summary(sign(f"v1.{VOCABULARY_VERSION}.{text_hash}.{mask:x}"), normalized, SECRET) is not None
+
+def test_rejects_unknown_versions_and_malformed_headers():
+    normalized = normalize_text(TEXT)
+    text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    assert decode_scan_summary(sign(f"v2.{VOCABULARY_VERSION}.{text_hash}.1"), normalized, SECRET) is None
+    assert decode_scan_summary(sign(f"v1.{VOCABULARY_VERSION}.{text_hash}.zz"), normalized, SECRET) is None
+    assert decode_scan_summary("v1.not-enough-parts", normalized, SECRET) is None
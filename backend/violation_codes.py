@@ -0,0 +1,66 @@
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Sequence
+import numpy as np
+
+# Every violation code the analyzer can emit. Code i is bit i of a violation mask, and masks
+# are kept in the analysis history, so only ever append to this tuple. The columnar analytics
+# store keeps masks in 16 bits.
+VIOLATION_CODES = (
+    "GDPR_NoConsent", "GDPR_DataRetention", "GDPR_DataSharing",
+    "HIPAA_Encryption", "HIPAA_Security",
+    "SOX_Controls"
+)
+CODE_IDS = {code: bit for bit, code in enumerate(VIOLATION_CODES)}
+
+(GDPR_NO_CONSENT, GDPR_DATA_RETENTION, GDPR_DATA_SHARING,
+ HIPAA_ENCRYPTION, HIPAA_SECURITY,
+ SOX_CONTROLS) = (1 << bit for bit in range(len(VIOLATION_CODES)))
+
+def regulation_mask(prefix: str) -> int:
+    return encode(code for code in VIOLATION_CODES if code.startswith(prefix + "_"))
+
+def encode(codes: Iterable[str]) -> int:
+    """Mask of the known codes among `codes` (anything else is ignored)"""
+    mask = 0
+    for code in codes:
+        bit = CODE_IDS.get(code)
+        if bit is not None:
+            mask |= 1 << bit
+    return mask
+
+@lru_cache(maxsize=1024)
+def _decode(mask: int) -> tuple:
+    return tuple(code for bit, code in enumerate(VIOLATION_CODES) if mask >> bit & 1)
+
+def decode(mask: int) -> List[str]:
+    """Codes set in the mask, in registry order -- only needed at the API boundary"""
+    return list(_decode(mask))
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """Code ids set in the mask, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def record_mask(record: Dict) -> int:
+    # History written before masks existed only has the evidence strings
+    mask = record.get("violation_mask")
+    return mask if mask is not None else encode(record.get("evidence") or ())
+
+def mask_bits(masks) -> np.ndarray:
+    """(n, codes) 0/1 matrix of the codes set in each mask"""
+    masks = np.asarray(masks, dtype=np.int64).reshape(-1, 1)
+    return (masks >> np.arange(len(VIOLATION_CODES), dtype=np.int64)) & 1
+
+def code_counts(masks, weights=None) -> np.ndarray:
+    """How many masks (or how much weight) have each code set"""
+    bits = mask_bits(masks)
+    if weights is None:
+        return bits.sum(axis=0)
+    return np.asarray(weights, dtype=np.float64) @ bits
+
+def regulation_counts(masks, regulation_masks: Sequence[int]) -> np.ndarray:
+    """(n, regulations) matrix of popcount(mask & regulation mask)"""
+    membership = mask_bits(list(regulation_masks)).T  # codes x regulations
+    return mask_bits(masks) @ membership
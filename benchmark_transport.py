@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Per-hop transport benchmark for CAEPA: TCP loopback vs Unix domain socket.
+
+Starts the backend twice (once on a TCP port, once on a Unix socket), sends the
+same /analyze requests over a pooled keep-alive client, and reports latency
+percentiles plus client and server CPU time for small and large payloads.
+
+Usage: python benchmark_transport.py [--requests 2000] [--port 8765]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+PAYLOADS = {
+    "small": "user_email = request.form['email']\nstore_data_forever(user_email)",
+    "large": ("We collect patient records and financial data and share with partners. " * 1500)
+}
+
+def server_cpu_seconds(pid: int):
+    """utime + stime of a process from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+def start_backend(args):
+    # History, columns and usage files go to a scratch directory, never into the source tree;
+    # running from there also keeps the backend away from any legacy history JSON in backend/
+    state_dir = tempfile.mkdtemp(prefix="caepa-bench-")
+    env = {
+        **os.environ,
+        "PYTHONUNBUFFERED": "1",
+        "ANALYTICS_DB_FILE": os.path.join(state_dir, "compliance_history.db"),
+        "ANALYTICS_COLUMNS_DIR": os.path.join(state_dir, "analytics_columns"),
+        "LLM_USAGE_FILE": os.path.join(state_dir, "llm_usage.jsonl")
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR, "--log-level", "warning", *args],
+        cwd=state_dir, env=env
+    )
+
+def wait_ready(client: httpx.Client, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if client.get("/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Backend did not become ready")
+
+def run(client: httpx.Client, pid: int, text: str, requests: int):
+    body = {"input_text": text, "analysis_type": "gdpr"}
+    for _ in range(min(100, requests)):
+        client.post("/analyze", json=body)
+
+    latencies = []
+    server_cpu_start = server_cpu_seconds(pid)
+    client_cpu_start = time.process_time()
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.post("/analyze", json=body).raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    client_cpu = time.process_time() - client_cpu_start
+    server_cpu_end = server_cpu_seconds(pid)
+
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "client_cpu_us_per_req": client_cpu / requests * 1e6,
+        "server_cpu_us_per_req": (server_cpu_end - server_cpu_start) / requests * 1e6
+        if server_cpu_start is not None and server_cpu_end is not None else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8765)
+    options = parser.parse_args()
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "caepa-backend.sock")
+    transports = {
+        "tcp": (["--host", "127.0.0.1", "--port", str(options.port)],
+                lambda: httpx.Client(base_url=f"http://127.0.0.1:{options.port}")),
+        "uds": (["--uds", socket_path],
+                lambda: httpx.Client(base_url="http://localhost", transport=httpx.HTTPTransport(uds=socket_path)))
+    }
+
+    print("🚀 CAEPA Transport Benchmark (TCP loopback vs Unix domain socket)")
+    print("=" * 72)
+    results = {}
+    for name, (server_args, make_client) in transports.items():
+        server = start_backend(server_args)
+        try:
+            with make_client() as client:
+                wait_ready(client)
+                for size, text in PAYLOADS.items():
+                    results[(name, size)] = run(client, server.pid, text, options.requests)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'payload':<8}{'transport':<11}{'p50 ms':>9}{'p99 ms':>9}{'client CPU µs':>15}{'server CPU µs':>15}")
+    for size in PAYLOADS:
+        for name in transports:
+            r = results[(name, size)]
+            server_cpu = f"{r['server_cpu_us_per_req']:.0f}" if r["server_cpu_us_per_req"] is not None else "n/a"
+            print(f"{size:<8}{name:<11}{r['p50_ms']:>9.3f}{r['p99_ms']:>9.3f}"
+                  f"{r['client_cpu_us_per_req']:>15.0f}{server_cpu:>15}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from fastapi import HTTPException, Request
+
+DEFAULT_ADMISSION_CONFIG = {
+    "tenant_rate": 20.0,             # sustained requests/second per tenant
+    "tenant_burst": 40,              # bucket size per tenant
+    "tenant_max_concurrency": 50,    # in-flight requests per tenant
+    "tenant_overrides": {},          # known tenant/client -> {"rate", "burst", "max_concurrency"}; see tenant_of()
+    "max_concurrency": 200,          # in-flight requests across all tenants
+    "max_queue": 100,                # requests allowed to wait for a slot
+    "queue_timeout_ms": 250,
+    "max_upstream_in_flight": 400,   # shed when the target upstream is this deep
+    "max_upstream_latency_ms": 5000, # shed when the target upstream is this slow
+    "retry_after_seconds": 1
+}
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.in_flight = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: int = 1) -> float:
+        """Seconds until `cost` tokens are available (0 if they are now); takes nothing.
+
+        A cost above the burst waits for a full bucket, then overdraws it.
+        """
+        self.refill()
+        needed = min(cost, self.burst)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def take(self, cost: int = 1):
+        # Requests that passed wait_time() together and then queued may overdraw slightly;
+        # the debt is repaid from refill before the bucket admits anyone else
+        self.refill()
+        self.tokens -= cost
+
+    def set_limits(self, rate: float, burst: float):
+        self.refill()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+    def evictable(self, now: float, min_idle: float) -> bool:
+        """Unused for min_idle seconds and refilled, so a fresh bucket would behave the same"""
+        idle = now - self.updated
+        return not self.in_flight and idle >= min_idle and self.tokens + idle * self.rate >= self.burst
+
+# Bucket for requests with neither a configured tenant nor a peer address (e.g. unix sockets)
+ANONYMOUS_TENANT = "anonymous"
+
+class AdmissionController:
+    """Per-tenant token buckets plus a global concurrency limit with a short wait queue"""
+
+    def __init__(self, config_path: Optional[str] = None, max_tenants: int = 10000,
+                 idle_eviction_seconds: float = 300.0):
+        self.config_path = config_path
+        self.config_mtime = None
+        self.config = dict(DEFAULT_ADMISSION_CONFIG)
+        self.max_tenants = max_tenants
+        # Limits in the config are for the whole gateway, and each worker process enforces its
+        # share. uvicorn doesn't tell workers how many siblings they have, so GATEWAY_WORKERS
+        # must match the --workers value the gateway is started with.
+        self.workers = max(1, int(os.getenv("GATEWAY_WORKERS", "1")))
+        self.buckets = OrderedDict()
+        self.idle_eviction_seconds = idle_eviction_seconds
+        self.last_eviction = time.monotonic()
+        self.in_flight = 0
+        self.queued = 0
+        self.slot_available = asyncio.Condition()
+        self.last_reload_check = 0.0
+        self.stats = {
+            "accepted": 0,
+            "queued": 0,
+            "shed_rate_limited": 0,
+            "shed_tenant_concurrency": 0,
+            "shed_queue_full": 0,
+            "shed_queue_timeout": 0,
+            "shed_upstream_overloaded": 0
+        }
+        self.reload()
+
+    def reload(self) -> Dict:
+        """Re-read the JSON config file and apply new limits to the live buckets.
+
+        Buckets are updated in place rather than replaced, so requests already in flight keep
+        counting against their tenant's concurrency cap.
+        """
+        config = dict(DEFAULT_ADMISSION_CONFIG)
+        if self.config_path and os.path.exists(self.config_path):
+            with open(self.config_path, 'r') as f:
+                config.update(json.load(f))
+            self.config_mtime = os.path.getmtime(self.config_path)
+        self.config = config
+        for tenant, bucket in self.buckets.items():
+            limits = self.tenant_limits(tenant)
+            bucket.set_limits(limits["rate"], limits["burst"])
+        return self.config
+
+    def maybe_reload(self):
+        """Pick up edits to the config file without a restart (checked at most every 5s)"""
+        now = time.monotonic()
+        if not self.config_path or now - self.last_reload_check < 5:
+            return
+        self.last_reload_check = now
+        try:
+            if os.path.exists(self.config_path) and os.path.getmtime(self.config_path) != self.config_mtime:
+                self.reload()
+        except (OSError, ValueError):
+            pass
+
+    def tenant_of(self, request: Request) -> str:
+        """The configured tenant a request belongs to, or else its client address.
+
+        The headers are not authenticated, so only values listed in tenant_overrides get their
+        own bucket: API keys by the first 16 hex digits of their sha256, tenant ids as is.
+        Everyone else is limited per peer address, which rotating header values can't change;
+        each address gets the default tenant limits (or its own entry in tenant_overrides).
+        """
+        known = self.config["tenant_overrides"]
+        api_key = request.headers.get("x-api-key")
+        if api_key:
+            # Never keep raw API keys around in memory or stats
+            key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+            if key_id in known:
+                return f"key:{key_id}"
+        tenant = request.headers.get("x-tenant-id")
+        if tenant and tenant in known:
+            return f"tenant:{tenant}"
+        if request.client and request.client.host:
+            return f"client:{request.client.host}"
+        return ANONYMOUS_TENANT
+
+    def bucket_for(self, tenant: str) -> TokenBucket:
+        bucket = self.buckets.get(tenant)
+        if bucket is None:
+            limits = self.tenant_limits(tenant)
+            bucket = TokenBucket(limits["rate"], limits["burst"])
+            self.buckets[tenant] = bucket
+            # Evict idle tenants first so the table stays bounded
+            while len(self.buckets) > self.max_tenants:
+                idle = next((t for t, b in self.buckets.items() if b.in_flight == 0), None)
+                if idle is None:
+                    break
+                del self.buckets[idle]
+        else:
+            self.buckets.move_to_end(tenant)
+        return bucket
+
+    def evict_idle(self):
+        """Drop buckets that have sat unused and full for a while (at most one sweep per minute)"""
+        now = time.monotonic()
+        if now - self.last_eviction < 60:
+            return
+        self.last_eviction = now
+        for tenant in [t for t, b in self.buckets.items() if b.evictable(now, self.idle_eviction_seconds)]:
+            del self.buckets[tenant]
+
+    def tenant_limits(self, tenant: str) -> Dict:
+        override = self.config["tenant_overrides"].get(tenant.split(":", 1)[-1], {})
+        return {
+            "rate": float(override.get("rate", self.config["tenant_rate"])) / self.workers,
+            "burst": max(1.0, float(override.get("burst", self.config["tenant_burst"])) / self.workers),
+            "max_concurrency": self.share(int(override.get("max_concurrency", self.config["tenant_max_concurrency"])))
+        }
+
+    def share(self, limit: int) -> int:
+        return max(1, math.ceil(limit / self.workers))
+
+    def shed(self, reason: str, status_code: int, retry_after: float, detail: str):
+        self.stats[reason] += 1
+        raise HTTPException(
+            status_code=status_code,
+            detail={"error": detail, "reason": reason},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    @asynccontextmanager
+    async def admit(self, request: Request, upstream_in_flight: int = 0, upstream_latency_ms: float = 0.0,
+                    cost: int = 1):
+        """Admit a request or raise 429/503 with Retry-After before any upstream work starts.
+
+        cost is the number of upstream calls the request makes; it is charged against the
+        rate limit and both concurrency limits as that many requests. A cost larger than a
+        limit is admitted only when nothing else holds that limit.
+        """
+        self.maybe_reload()
+        config = self.config
+        retry_after = config["retry_after_seconds"]
+
+        self.evict_idle()
+        tenant = self.tenant_of(request)
+        bucket = self.bucket_for(tenant)
+        # Only check for a token here; it is taken once the request is actually admitted
+        wait = bucket.wait_time(cost)
+        if wait > 0:
+            self.shed("shed_rate_limited", 429, wait, "Tenant rate limit exceeded")
+        tenant_concurrency = self.tenant_limits(tenant)["max_concurrency"]
+        if bucket.in_flight + min(cost, tenant_concurrency) > tenant_concurrency:
+            self.shed("shed_tenant_concurrency", 429, retry_after, "Too many concurrent requests for tenant")
+
+        # Latency only sheds while requests are outstanding, so an idle upstream always gets
+        # a request through to refresh its latency estimate
+        too_slow = upstream_in_flight > 0 and upstream_latency_ms >= config["max_upstream_latency_ms"]
+        if upstream_in_flight >= config["max_upstream_in_flight"] or too_slow:
+            self.shed("shed_upstream_overloaded", 503, retry_after, "Upstream overloaded, shedding load")
+
+        def has_room() -> bool:
+            max_concurrency = self.share(self.config["max_concurrency"])
+            return self.in_flight + min(cost, max_concurrency) <= max_concurrency
+
+        if not has_room():
+            if self.queued >= self.share(config["max_queue"]):
+                self.shed("shed_queue_full", 503, retry_after, "Gateway at capacity")
+            self.queued += 1
+            self.stats["queued"] += 1
+            try:
+                async with self.slot_available:
+                    await asyncio.wait_for(
+                        self.slot_available.wait_for(has_room),
+                        timeout=config["queue_timeout_ms"] / 1000
+                    )
+                    self.in_flight += cost
+            except asyncio.TimeoutError:
+                self.shed("shed_queue_timeout", 503, retry_after, "Gateway at capacity")
+            finally:
+                self.queued -= 1
+        else:
+            self.in_flight += cost
+
+        self.stats["accepted"] += 1
+        bucket.take(cost)
+        bucket.in_flight += cost
+        try:
+            yield tenant
+        finally:
+            bucket.in_flight -= cost
+            self.in_flight -= cost
+            async with self.slot_available:
+                # Waiters may each need several slots; let them all re-check
+                self.slot_available.notify_all()
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "waiting": self.queued,
+            "tracked_tenants": len(self.buckets),
+            "workers": self.workers,
+            "config": {k: v for k, v in self.config.items() if k != "tenant_overrides"},
+            "tenant_overrides": len(self.config["tenant_overrides"])
+        }
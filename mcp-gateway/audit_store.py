@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_entries (
+    id INTEGER PRIMARY KEY,
+    request_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    status TEXT NOT NULL,
+    domain TEXT,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_entries (ts, id);
+DROP INDEX IF EXISTS idx_audit_status;
+DROP INDEX IF EXISTS idx_audit_domain;
+CREATE INDEX IF NOT EXISTS idx_audit_status_ts ON audit_entries (status, ts, id);
+CREATE INDEX IF NOT EXISTS idx_audit_domain_ts ON audit_entries (domain, ts, id);
+
+CREATE TABLE IF NOT EXISTS audit_violations (
+    entry_id INTEGER NOT NULL,
+    violation_type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_violation_type ON audit_violations (violation_type, entry_id);
+
+CREATE TABLE IF NOT EXISTS audit_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def request_number(request_id: str) -> int:
+    return int(request_id.rsplit("_", 1)[-1])
+
+# Request numbers come in per-worker blocks, so only (timestamp, number) orders entries in time.
+# Pagination cursors carry that pair.
+def encode_cursor(ts: float, entry_id: int) -> str:
+    return f"{ts!r}:{entry_id}"
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """(timestamp, request number) from a cursor; raises ValueError if it is malformed"""
+    ts, entry_id = cursor.split(":")
+    return float(ts), int(entry_id)
+
+# audit_counters row holding the highest request number handed out to any worker
+ID_HIGH_WATER = "id_high_water"
+
+class AuditStore:
+    """Persistent, indexed audit trail (sqlite in WAL mode) with incrementally kept counters.
+
+    Safe to share between gateway worker processes: sqlite serializes writers, and request
+    numbers come from allocate_ids() so workers never hand out the same one.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def append_batch(self, entries: List[Dict]):
+        """Insert a batch of entries and bump their counters in one transaction.
+
+        Entries already stored are skipped, so a batch can be retried after a failed flush.
+        """
+        counters = {}
+
+        def bump(name):
+            counters[name] = counters.get(name, 0) + 1
+
+        violation_rows = []
+        with self.lock, self.conn:
+            for entry in entries:
+                entry_id = request_number(entry["request_id"])
+                ts = datetime.fromisoformat(entry["timestamp"]).timestamp()
+                inserted = self.conn.execute(
+                    "INSERT OR IGNORE INTO audit_entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry_id, entry["request_id"], ts, entry["status"], entry.get("domain"), json.dumps(entry))
+                ).rowcount
+                if not inserted:
+                    continue
+                bump("total")
+                bump(f"status:{entry['status']}")
+                if entry.get("domain"):
+                    bump(f"domain:{entry['domain']}")
+                for violation in entry.get("violations", []):
+                    violation_rows.append((entry_id, violation["type"]))
+                    bump(f"violation:{violation['type']}")
+            self.conn.executemany("INSERT INTO audit_violations VALUES (?, ?)", violation_rows)
+            self.conn.executemany(
+                "INSERT INTO audit_counters VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                list(counters.items())
+            )
+
+    def query(self, limit: int = 100, cursor: Optional[str] = None, status: Optional[str] = None,
+              domain: Optional[str] = None, violation_type: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None) -> Dict:
+        """Newest-first page of entries; pass next_cursor back to get the following page"""
+        clauses = []
+        params = []
+        if cursor is not None:
+            clauses.append("(e.ts, e.id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        if status:
+            clauses.append("e.status = ?")
+            params.append(status)
+        if domain:
+            clauses.append("e.domain = ?")
+            params.append(domain)
+        if since is not None:
+            clauses.append("e.ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("e.ts < ?")
+            params.append(until)
+        if violation_type:
+            clauses.append("e.id IN (SELECT entry_id FROM audit_violations WHERE violation_type = ?)")
+            params.append(violation_type)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT e.ts, e.id, e.entry FROM audit_entries e {where} ORDER BY e.ts DESC, e.id DESC LIMIT ?"
+        with self.lock:
+            rows = self.conn.execute(sql, params + [limit]).fetchall()
+
+        return {
+            "entries": [json.loads(entry) for _, _, entry in rows],
+            "next_cursor": encode_cursor(rows[-1][0], rows[-1][1]) if len(rows) == limit else None
+        }
+
+    def counters(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT name, value FROM audit_counters WHERE name != ?", (ID_HIGH_WATER,)
+            ).fetchall())
+
+    def allocate_ids(self, count: int) -> range:
+        """Reserve a block of request numbers (hi/lo allocation shared by all workers)"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT value FROM audit_counters WHERE name = ?", (ID_HIGH_WATER,)).fetchone()
+                if row is None:
+                    # First allocation on an older database: continue after the stored entries
+                    row = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM audit_entries").fetchone()
+                start = row[0] + 1
+                self.conn.execute(
+                    "INSERT INTO audit_counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                    (ID_HIGH_WATER, start + count - 1)
+                )
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+        return range(start, start + count)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
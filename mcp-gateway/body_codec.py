@@ -0,0 +1,36 @@
+import json
+from typing import Dict
+
+try:
+    import orjson
+
+    def loads(raw: bytes):
+        return orjson.loads(raw)
+except ImportError:
+    orjson = None
+
+    def loads(raw: bytes):
+        return json.loads(raw)
+
+def splice_json_fields(raw: bytes, fields: Dict) -> bytes:
+    """Append fields to a JSON object without decoding it.
+
+    Only the new fields are encoded; the rest of the payload is copied as-is.
+    A spliced key that already exists wins on decode (JSON parsers keep the last
+    duplicate), which is how routing metadata overrides upstream values.
+    Anything that is not a JSON object is returned unchanged.
+    """
+    body = raw.rstrip()
+    start = len(body) - len(body.lstrip())
+    if not body.endswith(b"}") or body[start:start + 1] != b"{":
+        return raw
+
+    encoded = b",".join(
+        json.dumps(key).encode("utf-8") + b":" + json.dumps(value).encode("utf-8")
+        for key, value in fields.items()
+    )
+    if not encoded:
+        return raw
+
+    empty_object = not body[start + 1:-1].strip()
+    return body[:-1] + (b"" if empty_object else b",") + encoded + b"}"
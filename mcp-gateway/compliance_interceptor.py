@@ -1,38 +1,111 @@
+import asyncio
+import fcntl
+import itertools
 import json
 import logging
+import os
+from collections import deque
 from datetime import datetime
 from typing import Dict, List, Optional
+from scan_summary import build_scan_summary
+from audit_store import AuditStore, request_number, encode_cursor, decode_cursor
+
+# Request numbers reserved from the shared store per round trip, and how few may be left
+# before the next block is reserved in the background
+ID_BLOCK_SIZE = 100
+ID_PREFETCH_AT = 20
 
 class ComplianceInterceptor:
-    def __init__(self):
+    def __init__(self, audit_capacity: int = 1000, log_dir: Optional[str] = "logs",
+                 max_log_bytes: int = 10 * 1024 * 1024, log_backups: int = 5,
+                 scan_secret: Optional[str] = None, max_pending: int = 100000):
         self.blocked_patterns = [
             "us_client_id",
             "eu_personal_data", 
             "cross_border_transfer",
             "unauthorized_access"
         ]
-        self.audit_log = []
+        # Recent entries only; the full history is persisted to the audit store and rotating file
+        self.audit_log = deque(maxlen=audit_capacity)
+        self.audit_store = None
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+            self.audit_store = AuditStore(os.path.join(log_dir, "audit.db"))
+        
+        # With a store, ids come in blocks shared by every worker and the stats are read back
+        # from it; without one (single process only) they are kept here
+        self.request_ids = itertools.count(1)
+        self.id_block = range(0)
+        self.id_position = 0
+        self.id_refill: Optional[asyncio.Task] = None
+        self.total_requests = 0
+        self.blocked_requests = 0
+        
+        # Shared with trusting backends so they can reuse this scan instead of repeating it
+        self.scan_secret = scan_secret
+        
+        # Entries waiting for the background writer. Bounded so a failing disk can't grow it
+        # without limit; entries past the bound are dropped and counted.
+        self.pending_entries = deque()
+        self.max_pending = max_pending
+        self.dropped_entries = 0
+        self.log_path = os.path.join(log_dir, "compliance_audit.jsonl") if log_dir else None
+        self.max_log_bytes = max_log_bytes
+        self.log_backups = log_backups
+        self.writer_task = None
         
         # Setup logging
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger("ComplianceInterceptor")
 
-    def intercept_request(self, request_data: Dict) -> Dict:
-        """Real-time regulatory firewall for MCP Gateway"""
+    def _prefetch_ids(self):
+        # Reserving a block may wait on another worker's write lock, so never on the event loop
+        if self.id_refill is None:
+            self.id_refill = asyncio.create_task(asyncio.to_thread(self.audit_store.allocate_ids, ID_BLOCK_SIZE))
+
+    async def next_request_id(self) -> int:
+        if not self.audit_store:
+            return next(self.request_ids)
+        while self.id_position >= len(self.id_block):
+            self._prefetch_ids()
+            refill = self.id_refill
+            try:
+                # Shielded: a cancelled request must not cancel the block everyone waits on
+                block = await asyncio.shield(refill)
+            except Exception:
+                if self.id_refill is refill:
+                    self.id_refill = None
+                raise
+            if self.id_refill is refill:
+                self.id_refill = None
+                self.id_block, self.id_position = block, 0
+        request_number = self.id_block[self.id_position]
+        self.id_position += 1
+        if len(self.id_block) - self.id_position <= ID_PREFETCH_AT:
+            self._prefetch_ids()
+        return request_number
+
+    async def intercept_request(self, request_data: Dict, domains: Optional[List[str]] = None) -> Dict:
+        """Real-time regulatory firewall for MCP Gateway (optionally for several domains at once)"""
+        
+        # Extract request content
+        input_text = request_data.get("input_text", "").lower()
+        domain = request_data.get("analysis_type", "general")
         
         audit_entry = {
             "timestamp": datetime.now().isoformat(),
-            "request_id": f"req_{len(self.audit_log) + 1}",
+            "request_id": f"req_{await self.next_request_id()}",
             "action": "INTERCEPT_ANALYSIS",
-            "status": "PENDING"
+            "status": "PENDING",
+            "domain": domain
         }
-
-        # Extract request content
-        input_text = request_data.get("input_text", "").lower()
-        domain = request_data.get("analysis_type", "general")
         
         # Check for regulatory violations
-        violations = self.detect_violations(input_text, domain)
+        violations = []
+        for check_domain in domains or [domain]:
+            for violation in self.detect_violations(input_text, check_domain):
+                if violation not in violations:
+                    violations.append(violation)
         
         if violations:
             # BLOCK REQUEST - Regulatory firewall activated
@@ -43,8 +116,7 @@ class ComplianceInterceptor:
                 "blocked_patterns": [v["pattern"] for v in violations]
             })
             
-            self.audit_log.append(audit_entry)
-            self.logger.warning(f"🚫 BLOCKED REQUEST {audit_entry['request_id']}: {violations}")
+            self.record_audit_entry(audit_entry)
             
             return {
                 "blocked": True,
@@ -62,14 +134,91 @@ class ComplianceInterceptor:
                 "domain": domain
             })
             
-            self.audit_log.append(audit_entry)
-            self.logger.info(f"✅ ALLOWED REQUEST {audit_entry['request_id']}")
+            self.record_audit_entry(audit_entry)
             
-            return {
+            result = {
                 "blocked": False,
                 "audit_id": audit_entry["request_id"],
                 "message": "Request approved by compliance firewall"
             }
+            if self.scan_secret:
+                result["scan_summary"] = build_scan_summary(request_data.get("input_text", ""), self.scan_secret)
+            return result
+
+    def record_audit_entry(self, audit_entry: Dict):
+        """Keep the entry in the ring buffer and queue it for batched persistence"""
+        self.audit_log.append(audit_entry)
+        self.total_requests += 1
+        if audit_entry["status"] == "BLOCKED":
+            self.blocked_requests += 1
+        if self.log_path:
+            if len(self.pending_entries) >= self.max_pending:
+                self.dropped_entries += 1
+                if self.dropped_entries % 1000 == 1:
+                    self.logger.error(f"Audit queue full; {self.dropped_entries} entries dropped so far")
+                return
+            self.pending_entries.append(audit_entry)
+
+    async def start_audit_writer(self, flush_interval: float = 1.0):
+        if self.log_path and self.writer_task is None:
+            self.writer_task = asyncio.create_task(self._audit_writer_loop(flush_interval))
+
+    async def stop_audit_writer(self):
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+            self.writer_task = None
+        await self.flush_audit_log()
+        if self.audit_store:
+            self.audit_store.close()
+
+    async def _audit_writer_loop(self, flush_interval: float):
+        while True:
+            await asyncio.sleep(flush_interval)
+            try:
+                await self.flush_audit_log()
+            except Exception as e:
+                self.logger.error(f"Audit log flush failed: {e}")
+
+    async def flush_audit_log(self):
+        """Append all pending entries to the audit file in one batch, off the event loop"""
+        if not self.pending_entries:
+            return
+        batch = []
+        while self.pending_entries:
+            batch.append(self.pending_entries.popleft())
+        try:
+            await asyncio.to_thread(self._write_audit_batch, batch)
+        except Exception:
+            # Put the batch back ahead of newer entries for the next flush (the store skips
+            # entries it already has, so a half-written batch isn't counted twice)
+            self.pending_entries.extendleft(reversed(batch))
+            raise
+
+    def _write_audit_batch(self, batch: List[Dict]):
+        if self.audit_store:
+            self.audit_store.append_batch(batch)
+        data = "".join(json.dumps(entry) + "\n" for entry in batch)
+        # Workers share the file; serialize the size check, rotation and append between them
+        with open(self.log_path + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.log_path) and os.path.getsize(self.log_path) + len(data) > self.max_log_bytes:
+                    self._rotate_audit_file()
+                with open(self.log_path, 'a') as f:
+                    f.write(data)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _rotate_audit_file(self):
+        for index in range(self.log_backups - 1, 0, -1):
+            source = f"{self.log_path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.log_path}.{index + 1}")
+        os.replace(self.log_path, f"{self.log_path}.1")
 
     def detect_violations(self, input_text: str, domain: str) -> List[Dict]:
         violations = []
@@ -107,18 +256,60 @@ class ComplianceInterceptor:
         return violations
 
     def get_audit_trail(self) -> List[Dict]:
-        """Enterprise audit trail for compliance reporting"""
-        return self.audit_log
+        """Enterprise audit trail for compliance reporting (most recent entries)"""
+        return list(self.audit_log)
+
+    async def query_audit_trail(self, limit: int = 100, cursor: Optional[str] = None, **filters) -> Dict:
+        """Paginated, filtered audit history from the persistent store, newest first"""
+        if not self.audit_store:
+            # Persistence disabled: filter what the ring buffer still holds
+            after = decode_cursor(cursor) if cursor is not None else None
+            entries = [
+                entry for entry in sorted(self.audit_log, key=self._entry_order, reverse=True)
+                if (after is None or self._entry_order(entry) < after)
+                and (not filters.get("status") or entry["status"] == filters["status"])
+                and (not filters.get("domain") or entry.get("domain") == filters["domain"])
+                and (not filters.get("violation_type") or any(
+                    v["type"] == filters["violation_type"] for v in entry.get("violations", [])))
+                and (filters.get("since") is None or datetime.fromisoformat(entry["timestamp"]).timestamp() >= filters["since"])
+                and (filters.get("until") is None or datetime.fromisoformat(entry["timestamp"]).timestamp() < filters["until"])
+            ][:limit]
+            next_cursor = encode_cursor(*self._entry_order(entries[-1])) if len(entries) == limit else None
+            return {"entries": entries, "next_cursor": next_cursor}
+        
+        # Make entries from the last flush interval visible too
+        await self.flush_audit_log()
+        return await asyncio.to_thread(self.audit_store.query, limit, cursor, **filters)
 
-    def generate_compliance_report(self) -> Dict:
-        """Generate compliance firewall statistics"""
-        total_requests = len(self.audit_log)
-        blocked_requests = len([log for log in self.audit_log if log["status"] == "BLOCKED"])
+    @staticmethod
+    def _entry_order(entry: Dict):
+        return datetime.fromisoformat(entry["timestamp"]).timestamp(), request_number(entry["request_id"])
+
+    async def compliance_report(self) -> Dict:
+        """generate_compliance_report() with its sqlite reads off the event loop"""
+        # Snapshot the pending queue here; the loop keeps appending to it meanwhile
+        return await asyncio.to_thread(self.generate_compliance_report, list(self.pending_entries))
+
+    def generate_compliance_report(self, pending: Optional[List[Dict]] = None) -> Dict:
+        """Generate compliance firewall statistics (blocking: reads the audit store)"""
+        if self.audit_store:
+            # Store counters cover every worker; add our own entries not yet flushed
+            counters = self.audit_store.counters()
+            if pending is None:
+                pending = list(self.pending_entries)
+            total_requests = counters.get("total", 0) + len(pending)
+            blocked_requests = counters.get("status:BLOCKED", 0) + sum(e["status"] == "BLOCKED" for e in pending)
+            recent = self.audit_store.query(limit=10)["entries"][::-1]
+        else:
+            total_requests = self.total_requests
+            blocked_requests = self.blocked_requests
+            recent = list(itertools.islice(reversed(self.audit_log), 10))[::-1]
         
         return {
             "total_requests": total_requests,
             "blocked_requests": blocked_requests,
             "block_rate": f"{(blocked_requests/total_requests*100):.1f}%" if total_requests > 0 else "0%",
             "compliance_effectiveness": "HIGH" if blocked_requests > 0 else "MONITORING",
-            "audit_entries": self.audit_log[-10:]  # Last 10 entries
+            "dropped_audit_entries": self.dropped_entries,  # this worker's, while its queue was full
+            "audit_entries": recent  # Last 10 entries
         }
\ No newline at end of file
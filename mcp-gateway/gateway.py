@@ -1,14 +1,70 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
 import httpx
 import os
-from typing import Dict
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
 from compliance_interceptor import ComplianceInterceptor
+from scan_summary import scan_secret_from_env
+from upstreams import UpstreamClients, DeadlineExceeded, endpoint_of
+from body_codec import loads, splice_json_fields
+from admission import AdmissionController
+from metrics import (
+    registry, stage, stages, observe_request, current_breakdown, wants_timings, server_timing, TIMINGS_HEADER
+)
+from profiler import profiler, current_profile, PROFILE_HEADER, PROFILE_ID_HEADER
+
+# Service routing configuration: each domain maps to one or more replicas.
+# Override with e.g. GATEWAY_ROUTE_GDPR="http://gdpr-1:8000,http://gdpr-2:8000"; co-located
+# backends started with CAEPA_UDS_PATH can be reached as "unix:///run/caepa/gdpr.sock"
+SERVICE_ROUTES = {
+    "gdpr": ["http://gdpr-service:8001"],
+    "hipaa": ["http://hipaa-service:8002"], 
+    "sox": ["http://sox-service:8003"],
+    "general": ["http://backend:8000"]
+}
+for route_domain in SERVICE_ROUTES:
+    override = os.getenv(f"GATEWAY_ROUTE_{route_domain.upper()}")
+    if override:
+        SERVICE_ROUTES[route_domain] = [url.strip() for url in override.split(",") if url.strip()]
+
+# Domains queried by /analyze/all when the client doesn't pick any
+SCATTER_DEFAULT_DOMAINS = ["gdpr", "hipaa", "sox"]
+SCATTER_DEADLINE_SECONDS = float(os.getenv("GATEWAY_SCATTER_DEADLINE", "10.0"))
+STATUS_SEVERITY = {"GREEN": 0, "YELLOW": 1, "RED": 2}
 
-app = FastAPI(title="CAEPA MCP Gateway - Enterprise Compliance Firewall")
+# End-to-end budget: clients may ask for less via X-Request-Timeout-Ms, never more than the max
+DEFAULT_DEADLINE_MS = float(os.getenv("GATEWAY_DEFAULT_DEADLINE_MS", "30000"))
+MAX_DEADLINE_MS = float(os.getenv("GATEWAY_MAX_DEADLINE_MS", "120000"))
 
 # Initialize compliance interceptor
-interceptor = ComplianceInterceptor()
+interceptor = ComplianceInterceptor(
+    audit_capacity=int(os.getenv("AUDIT_BUFFER_SIZE", "1000")),
+    max_pending=int(os.getenv("AUDIT_MAX_PENDING", "100000")),
+    log_dir=os.getenv("AUDIT_LOG_DIR", "logs") if os.getenv("AUDIT_LOGGING", "ENABLED") == "ENABLED" else None,
+    scan_secret=scan_secret_from_env()
+)
+
+# Per-tenant rate limits and global concurrency, reloadable from GATEWAY_ADMISSION_CONFIG
+admission = AdmissionController(os.getenv("GATEWAY_ADMISSION_CONFIG", "admission.json"))
+
+# Pooled keep-alive clients shared by every proxied request
+upstreams = UpstreamClients(SERVICE_ROUTES)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstreams.start()
+    await interceptor.start_audit_writer()
+    yield
+    await interceptor.stop_audit_writer()
+    await upstreams.close()
+
+app = FastAPI(title="CAEPA MCP Gateway - Enterprise Compliance Firewall", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,13 +74,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Service routing configuration
-SERVICE_ROUTES = {
-    "gdpr": "http://gdpr-service:8001",
-    "hipaa": "http://hipaa-service:8002", 
-    "sox": "http://sox-service:8003",
-    "general": "http://backend:8000"
-}
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Request counters/latency for /metrics, plus a Server-Timing stage breakdown on request"""
+    breakdown = {} if wants_timings(request.headers) else None
+    token = current_breakdown.set(breakdown)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_breakdown.reset(token)
+    route = request.scope.get("route")
+    observe_request(route.path if route else "unmatched", request.method, response.status_code,
+                    time.perf_counter() - start)
+    if breakdown:
+        response.headers["Server-Timing"] = server_timing(breakdown)
+    return response
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Sample this request's stacks when asked to (debug only) or picked by global sampling"""
+    requested = profiler.requested(request.headers)
+    if not requested and not profiler.sampled():
+        return await call_next(request)
+    session = profiler.start(f"{request.method} {request.url.path}", requested)
+    token = current_profile.set(session)
+    try:
+        response = await call_next(request)
+    finally:
+        current_profile.reset(token)
+        profiler.stop(session)
+    response.headers[PROFILE_ID_HEADER] = session.profile_id
+    return response
+
+def merge_upstream_timings(response: httpx.Response, prefix: str):
+    """Fold a backend's Server-Timing stages into this request's breakdown as prefix.stage"""
+    breakdown = current_breakdown.get()
+    header = response.headers.get("server-timing")
+    if breakdown is None or not header:
+        return
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        if params.startswith("dur="):
+            try:
+                breakdown[f"{prefix}.{name}"] = float(params[4:])
+            except ValueError:
+                continue
 
 @app.get("/")
 def gateway_info():
@@ -34,19 +129,49 @@ def gateway_info():
         "routing": "Multi-tenant compliance analysis"
     }
 
-@app.post("/analyze/{domain}")
-async def route_analysis(domain: str, request: Request):
-    if domain not in SERVICE_ROUTES:
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Domain '{domain}' not supported. Available: {list(SERVICE_ROUTES.keys())}"
-        )
-    
-    request_body = await request.json()
-    
-    # 🛡️ COMPLIANCE INTERCEPTOR - Real-time regulatory firewall
-    compliance_check = interceptor.intercept_request(request_body)
-    
+def content_routing_key(domain: str, request_body: Dict) -> str:
+    """(domain, normalized-content hash) so repeat submissions hit the replica that cached them"""
+    normalized = " ".join(str(request_body.get("input_text", "")).lower().split())
+    return f"{domain}:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}"
+
+def request_deadline(request: Request) -> float:
+    """time.monotonic() expiry for this request, from the client's timeout or the default"""
+    budget_ms = DEFAULT_DEADLINE_MS
+    value = request.headers.get("x-request-timeout-ms")
+    if value:
+        try:
+            budget_ms = float(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout-Ms must be a number")
+    return time.monotonic() + min(max(budget_ms, 0.0), MAX_DEADLINE_MS) / 1000
+
+JSON_HEADERS = {"content-type": "application/json"}
+
+def upstream_headers(compliance_check: Dict) -> Dict[str, str]:
+    """Headers for the proxied request, including the signed interceptor scan if enabled"""
+    headers = JSON_HEADERS
+    if "scan_summary" in compliance_check:
+        headers = {**headers, "x-caepa-scan": compliance_check["scan_summary"]}
+    if current_breakdown.get() is not None:
+        headers = {**headers, TIMINGS_HEADER: "1"}
+    session = current_profile.get()
+    if session is not None and session.requested:
+        # Profile the backend's share of this request too (it must also run with debug on)
+        headers = {**headers, PROFILE_HEADER: "1"}
+    return headers
+
+async def read_request_body(request: Request):
+    """Raw body bytes (forwarded untouched) plus the parsed object for the interceptor"""
+    raw_body = await request.body()
+    try:
+        request_body = loads(raw_body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be valid JSON")
+    if not isinstance(request_body, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+    return raw_body, request_body
+
+def raise_if_blocked(compliance_check: Dict):
     if compliance_check["blocked"]:
         # Request blocked by compliance firewall
         raise HTTPException(
@@ -59,42 +184,297 @@ async def route_analysis(domain: str, request: Request):
                 "firewall_status": "BLOCKED"
             }
         )
+
+@app.post("/analyze/all")
+async def scatter_analysis(request: Request, domains: Optional[str] = None,
+                           deadline_ms: Optional[int] = Query(None, ge=0)):
+    """Analyze one document against several domain services concurrently and merge the results"""
+    requested = [d.strip() for d in domains.split(",") if d.strip()] if domains else SCATTER_DEFAULT_DOMAINS
+    unknown = [d for d in requested if d not in SERVICE_ROUTES]
+    if unknown:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Domain(s) {unknown} not supported. Available: {list(SERVICE_ROUTES.keys())}"
+        )
     
-    # Request approved - proceed to service
-    target_url = SERVICE_ROUTES[domain]
+    # The most loaded of the target upstreams decides whether to shed
+    loads_by_domain = [upstreams.load(d) for d in requested]
+    admission_start = time.perf_counter()
+    # Charged as one request per upstream call it fans out to
+    async with admission.admit(
+        request,
+        upstream_in_flight=max(in_flight for in_flight, _ in loads_by_domain),
+        upstream_latency_ms=max(latency for _, latency in loads_by_domain),
+        cost=len(dict.fromkeys(requested))
+    ):
+        stages.record("admission", time.perf_counter() - admission_start)
+        return await scatter_admitted(request, requested, deadline_ms)
+
+async def scatter_admitted(request: Request, requested: List[str], deadline_ms: Optional[int]):
+    # Time spent queued in admission already counts against the client's budget
+    expires_at = min(
+        request_deadline(request),
+        time.monotonic() + (deadline_ms / 1000 if deadline_ms is not None else SCATTER_DEADLINE_SECONDS)
+    )
+    if expires_at <= time.monotonic():
+        raise HTTPException(status_code=504, detail="Deadline exceeded before the scatter started")
+    raw_body, request_body = await read_request_body(request)
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{target_url}/analyze",
-                json=request_body,
-                timeout=30.0
+    # 🛡️ One interceptor pass covers every requested domain
+    with stage("interceptor"):
+        compliance_check = await interceptor.intercept_request(request_body, domains=requested)
+    raise_if_blocked(compliance_check)
+    
+    deadline = max(0.0, expires_at - time.monotonic())
+    # Each service gets the original bytes with its analysis_type spliced on the end
+    tasks = {
+        domain: asyncio.create_task(timed_post(
+            domain,
+            splice_json_fields(raw_body, {"analysis_type": domain}),
+            content_routing_key(domain, request_body),
+            upstream_headers(compliance_check),
+            expires_at
+        ))
+        for domain in dict.fromkeys(requested)
+    }
+    with stage("scatter"):
+        await asyncio.wait(tasks.values(), timeout=deadline)
+    
+    service_results = {}
+    for domain, task in tasks.items():
+        if not task.done() or isinstance(task.exception(), DeadlineExceeded):
+            task.cancel()
+            service_results[domain] = {"source": domain, "status": "TIMEOUT", "error": f"No response within {deadline:.1f}s"}
+        elif task.exception() is not None:
+            service_results[domain] = {"source": domain, "status": "UNAVAILABLE", "error": str(task.exception())}
+        else:
+            result, latency_ms, endpoint = task.result()
+            service_results[domain] = {
+                "source": domain, "status": "OK", "latency_ms": latency_ms, "result": result,
+                "service_endpoint": endpoint  # with result["analysis_id"], what /explain needs
+            }
+    
+    merged = merge_service_results(service_results)
+    merged["compliance_audit_id"] = compliance_check["audit_id"]
+    merged["firewall_status"] = "APPROVED"
+    merged["routed_via"] = f"MCP Gateway -> {', '.join(tasks)} services"
+    if current_breakdown.get() is not None:
+        merged["gateway_stage_timings_ms"] = dict(current_breakdown.get())
+    return merged
+
+async def timed_post(domain: str, raw_body: bytes, routing_key: str, headers: Dict[str, str], deadline: float):
+    start_time = time.time()
+    response = await upstreams.post(
+        domain, "/analyze", routing_key=routing_key, deadline=deadline, content=raw_body, headers=headers
+    )
+    response.raise_for_status()
+    merge_upstream_timings(response, domain)
+    return loads(response.content), int((time.time() - start_time) * 1000), endpoint_of(response)
+
+def merge_service_results(service_results: Dict[str, Dict]) -> Dict:
+    """Merge per-service analyses into one verdict: worst status and grade, union of evidence"""
+    answered = {d: r["result"] for d, r in service_results.items() if r["status"] == "OK"}
+    
+    evidence_sources = {}
+    for domain, result in answered.items():
+        for item in result.get("evidence", []):
+            evidence_sources.setdefault(item, []).append(domain)
+    
+    statuses = [result.get("status", "YELLOW") for result in answered.values()]
+    status = max(statuses, key=lambda s: STATUS_SEVERITY.get(s, 1)) if statuses else "UNKNOWN"
+    
+    grades = {d: r["compliance_grade"] for d, r in answered.items() if r.get("compliance_grade")}
+    worst_grade = min(grades.values(), key=lambda g: g.get("percentage_score", 100)) if grades else {}
+    
+    missing = [d for d, r in service_results.items() if r["status"] != "OK"]
+    return {
+        "status": status,
+        "evidence": list(evidence_sources),
+        "evidence_sources": evidence_sources,
+        "compliance_grade": worst_grade,
+        "grades_by_domain": grades,
+        "service_results": service_results,
+        "partial": bool(missing),
+        "missing_domains": missing,
+        "latency_ms": max((r.get("latency_ms", 0) for r in service_results.values()), default=0)
+    }
+
+@app.post("/analyze/{domain}")
+async def route_analysis(domain: str, request: Request):
+    if domain not in SERVICE_ROUTES:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Domain '{domain}' not supported. Available: {list(SERVICE_ROUTES.keys())}"
+        )
+    
+    # Shed before reading the body so abusive tenants cost as little as possible
+    upstream_in_flight, upstream_latency_ms = upstreams.load(domain)
+    admission_start = time.perf_counter()
+    async with admission.admit(request, upstream_in_flight, upstream_latency_ms):
+        stages.record("admission", time.perf_counter() - admission_start)
+        return await route_admitted(domain, request)
+
+async def route_admitted(domain: str, request: Request):
+    expires_at = request_deadline(request)
+    raw_body, request_body = await read_request_body(request)
+    
+    # 🛡️ COMPLIANCE INTERCEPTOR - Real-time regulatory firewall
+    with stage("interceptor"):
+        compliance_check = await interceptor.intercept_request(request_body)
+    raise_if_blocked(compliance_check)
+    
+    # Request approved - proceed to service with the client's bytes, unmodified
+    try:
+        with stage("proxy"):
+            response = await upstreams.post(
+                domain, "/analyze", routing_key=content_routing_key(domain, request_body),
+                deadline=expires_at, content=raw_body, headers=upstream_headers(compliance_check)
             )
-            
-            result = response.json()
-            result["routed_via"] = f"MCP Gateway -> {domain} service"
-            result["service_endpoint"] = target_url
-            result["compliance_audit_id"] = compliance_check["audit_id"]
-            result["firewall_status"] = "APPROVED"
-            
-            return result
-            
+        merge_upstream_timings(response, domain)
+        
+        # Routing metadata is spliced onto the upstream body and mirrored in headers,
+        # so the (possibly large) analysis result is never decoded and re-encoded
+        routing = {
+            "routed_via": f"MCP Gateway -> {domain} service",
+            "service_endpoint": endpoint_of(response),
+            "compliance_audit_id": compliance_check["audit_id"],
+            "firewall_status": "APPROVED"
+        }
+        if current_breakdown.get() is not None:
+            routing["gateway_stage_timings_ms"] = dict(current_breakdown.get())
+        headers = {
+            "X-Routed-Via": routing["routed_via"],
+            "X-Service-Endpoint": routing["service_endpoint"],
+            "X-Compliance-Audit-Id": routing["compliance_audit_id"],
+            "X-Firewall-Status": routing["firewall_status"]
+        }
+        if PROFILE_ID_HEADER in response.headers:
+            headers["X-Upstream-Profile-Id"] = response.headers[PROFILE_ID_HEADER]
+        return Response(
+            content=splice_json_fields(response.content, routing),
+            status_code=response.status_code,
+            media_type="application/json",
+            headers=headers
+        )
+        
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service {domain} unavailable: {str(e)}"
+        )
+
+@app.get("/explain/{domain}/{analysis_id}")
+async def explain_analysis(domain: str, analysis_id: int, request: Request, endpoint: Optional[str] = None):
+    """Reasoning chain for an analysis_id returned by /analyze/{domain}.
+
+    Analysis ids are only unique per replica, so `endpoint` must be the service_endpoint that
+    came back with the analysis whenever the domain has more than one replica.
+    """
+    if domain not in SERVICE_ROUTES:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Domain '{domain}' not supported. Available: {list(SERVICE_ROUTES.keys())}"
+        )
+    if endpoint is not None:
+        replica = upstreams.replica_at(domain, endpoint)
+        if replica is None:
+            raise HTTPException(status_code=404, detail=f"'{endpoint}' is not a {domain} replica")
+    elif len(upstreams.replicas[domain]) == 1:
+        replica = upstreams.replicas[domain][0]
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{domain} has several replicas; pass the analysis' service_endpoint as ?endpoint="
+        )
+    
+    upstream_in_flight, upstream_latency_ms = upstreams.load(domain)
+    async with admission.admit(request, upstream_in_flight, upstream_latency_ms):
+        try:
+            with stage("proxy"):
+                response = await upstreams.get(replica, f"/explain/{analysis_id}", deadline=request_deadline(request))
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
         except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=503,
-                detail=f"Service {domain} unavailable: {str(e)}"
-            )
+            raise HTTPException(status_code=503, detail=f"Service {domain} unavailable: {str(e)}")
+        return Response(content=response.content, status_code=response.status_code, media_type="application/json")
+
+def parse_timestamp(value: Optional[str], name: str) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' must be an ISO 8601 timestamp")
 
 @app.get("/audit-trail")
-def get_audit_trail():
+async def get_audit_trail(limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+                          status: Optional[str] = None, domain: Optional[str] = None,
+                          violation_type: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None):
+    try:
+        page = await interceptor.query_audit_trail(
+            limit, cursor,
+            status=status, domain=domain, violation_type=violation_type,
+            since=parse_timestamp(since, "since"), until=parse_timestamp(until, "until")
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor; pass back the next_cursor of a previous page")
     return {
-        "audit_trail": interceptor.get_audit_trail(),
-        "compliance_report": interceptor.generate_compliance_report()
+        "audit_trail": page["entries"],
+        "next_cursor": page["next_cursor"],
+        "compliance_report": await interceptor.compliance_report()
     }
 
 @app.get("/compliance-stats")
-def get_compliance_stats():
-    return interceptor.generate_compliance_report()
+async def get_compliance_stats():
+    return await interceptor.compliance_report()
+
+@app.get("/upstream-stats")
+def get_upstream_stats():
+    """Per-replica health, in-flight requests, latency and pool saturation"""
+    return upstreams.get_stats()
+
+@app.get("/admission-stats")
+def get_admission_stats():
+    """Accepted, queued and shed request counters for admission control"""
+    return admission.get_stats()
+
+@app.post("/admission/reload")
+def reload_admission_config():
+    """Re-read the admission config file without restarting the gateway"""
+    try:
+        return {"reloaded": True, "config": admission.reload()}
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid admission config: {str(e)}")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Stage timings and request counters in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profiles")
+def list_profiles():
+    """Stored request profiles and profiler settings"""
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    return profiler.get_stats()
+
+@app.get("/debug/profiles/cumulative", response_class=PlainTextResponse)
+def get_cumulative_profile():
+    """All sampled requests' stacks in collapsed format (pipe into flamegraph.pl)"""
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    return PlainTextResponse(profiler.cumulative_collapsed())
+
+@app.get("/debug/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str):
+    """One request's stacks in collapsed format"""
+    session = profiler.get_profile(profile_id) if profiler.enabled else None
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return PlainTextResponse(session.collapsed())
 
 @app.get("/health")
 def gateway_health():
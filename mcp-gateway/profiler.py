@@ -0,0 +1,150 @@
+import contextvars
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+# Identical copy of backend/profiler.py; the gateway image only ships mcp-gateway/.
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+class ProfileSession:
+    def __init__(self, profile_id: str, label: str, requested: bool):
+        self.profile_id = profile_id
+        self.label = label
+        self.requested = requested  # asked for by the caller, not picked by global sampling
+        self.started = time.time()
+        self.duration_ms = None
+        self.samples = 0
+        self.stacks = Counter()
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed format: "frame;frame;frame count" per line"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+class SamplingProfiler:
+    """Wall-clock sampler over sys._current_frames(), running only while sessions are open.
+
+    Async requests share the event loop thread, so a session sees every thread's stacks
+    while its request is in flight; under concurrency other requests' work shows up too.
+    Sampled requests (not X-Profile ones) also feed one cumulative profile, so production
+    hot spots can be found without restarting under a profiler. It keeps the heaviest
+    max_stacks stacks; the long tail is trimmed once it doubles that.
+    """
+
+    def __init__(self, interval_ms: float = 5.0, sample_rate: float = 0.0, debug: bool = False,
+                 keep_profiles: int = 50, max_stacks: int = 5000):
+        self.interval = interval_ms / 1000
+        self.sample_rate = sample_rate
+        self.debug = debug
+        self.profiles: "OrderedDict[str, ProfileSession]" = OrderedDict()
+        self.keep_profiles = keep_profiles
+        self.cumulative = Counter()
+        self.max_stacks = max_stacks
+        self.active: Dict[str, ProfileSession] = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.thread: Optional[threading.Thread] = None
+
+    def requested(self, headers) -> bool:
+        # Per-request profiling is debug-only: it hands internals back to the caller
+        return self.debug and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
+    def sampled(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @property
+    def enabled(self) -> bool:
+        return self.debug or self.sample_rate > 0
+
+    def start(self, label: str, requested: bool = False) -> ProfileSession:
+        session = ProfileSession(f"prof_{os.getpid()}_{next(self.ids):06d}", label, requested)
+        with self.lock:
+            self.active[session.profile_id] = session
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+                self.thread.start()
+        return session
+
+    def stop(self, session: ProfileSession):
+        session.duration_ms = round((time.time() - session.started) * 1000, 3)
+        with self.lock:
+            self.active.pop(session.profile_id, None)
+            # Requested sessions skew toward whatever the caller was debugging
+            if not session.requested:
+                self.cumulative.update(session.stacks)
+                if len(self.cumulative) > 2 * self.max_stacks:
+                    self.cumulative = Counter(dict(self.cumulative.most_common(self.max_stacks)))
+            self.profiles[session.profile_id] = session
+            while len(self.profiles) > self.keep_profiles:
+                self.profiles.popitem(last=False)
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while True:
+            with self.lock:
+                sessions = list(self.active.values())
+                if not sessions:
+                    # Nothing to profile: exit so idle servers pay nothing
+                    self.thread = None
+                    return
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = [
+                self._collapse(names.get(ident, str(ident)), frame)
+                for ident, frame in sys._current_frames().items()
+                if ident != me
+            ]
+            with self.lock:
+                for session in sessions:
+                    # Skip sessions that stopped while we were walking stacks
+                    if session.profile_id in self.active:
+                        session.samples += 1
+                        session.stacks.update(stacks)
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        frames.append(thread_name.replace(" ", "_"))
+        return ";".join(reversed(frames))
+
+    def get_profile(self, profile_id: str) -> Optional[ProfileSession]:
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+    def cumulative_collapsed(self) -> str:
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.cumulative.most_common())
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                "debug": self.debug,
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval * 1000,
+                "active_sessions": len(self.active),
+                "stored_profiles": [
+                    {"profile_id": p.profile_id, "label": p.label, "duration_ms": p.duration_ms, "samples": p.samples}
+                    for p in self.profiles.values()
+                ],
+                "cumulative_stacks": len(self.cumulative)
+            }
+
+# Session of the request being handled, if it is being profiled
+current_profile: contextvars.ContextVar = contextvars.ContextVar("current_profile", default=None)
+
+profiler = SamplingProfiler(
+    interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    debug=os.getenv("CAEPA_DEBUG", "false").lower() == "true",
+    max_stacks=int(os.getenv("PROFILE_MAX_STACKS", "5000"))
+)
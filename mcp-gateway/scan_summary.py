@@ -0,0 +1,40 @@
+import hashlib
+import hmac
+import os
+from typing import Optional
+
+# Identical copy of backend/rule_engine.py's vocabulary; the gateway image only
+# ships mcp-gateway/. Backends reject summaries whose vocabulary version differs.
+COMPLIANCE_KEYWORDS = (
+    "email", "consent",
+    "forever", "permanent", "indefinitely",
+    "third party", "send to third", "share with",
+    "patient", "medical", "health", "phi", "encrypt", "unencrypted",
+    "financial", "control",
+    "expiry", "authorization", "secure", "permission"
+)
+VOCABULARY_VERSION = hashlib.sha256("|".join(COMPLIANCE_KEYWORDS).encode("utf-8")).hexdigest()[:12]
+
+# The value .env.example once shipped. It is public, so anyone could forge summaries signed with it.
+PLACEHOLDER_SCAN_SECRET = "change_me_to_a_random_string"
+
+def scan_secret_from_env() -> Optional[str]:
+    """GATEWAY_SCAN_SECRET, or None when unset (scan summaries off); refuses the public placeholder"""
+    secret = os.getenv("GATEWAY_SCAN_SECRET") or None
+    if secret == PLACEHOLDER_SCAN_SECRET:
+        raise RuntimeError(
+            "GATEWAY_SCAN_SECRET is the example placeholder; set a random secret or leave it empty"
+        )
+    return secret
+
+def build_scan_summary(input_text: str, secret: str) -> str:
+    """Signed X-CAEPA-Scan header value: normalized-text hash plus keyword hit bitmask"""
+    normalized = input_text.lower().replace('_', ' ').replace('-', ' ')
+    mask = 0
+    for bit, keyword in enumerate(COMPLIANCE_KEYWORDS):
+        if keyword in normalized:
+            mask |= 1 << bit
+    text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    payload = f"v1.{VOCABULARY_VERSION}.{text_hash}.{mask:x}"
+    signature = hmac.new(secret.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{payload}.{signature}"
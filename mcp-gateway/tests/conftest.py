@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Gateway modules import each other by bare name, as when the gateway runs from mcp-gateway/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
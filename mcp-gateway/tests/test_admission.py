@@ -0,0 +1,113 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException, Request
+
+import admission
+from admission import ANONYMOUS_TENANT, AdmissionController, TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission, "time", SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+def make_request(headers=None, client=("10.0.0.1", 5000)) -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/analyze",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        "client": client
+    })
+
+def test_bucket_starts_full_and_refills_at_rate(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    for _ in range(5):
+        assert bucket.wait_time() == 0
+        bucket.take()
+    assert bucket.wait_time() == pytest.approx(0.1)
+    clock.advance(0.25)
+    assert bucket.wait_time() == 0
+    assert bucket.tokens == pytest.approx(2.5)
+    # Refill stops at the burst size
+    clock.advance(60)
+    bucket.refill()
+    assert bucket.tokens == 5
+
+def test_bucket_cost(clock):
+    bucket = TokenBucket(rate=2, burst=4)
+    assert bucket.wait_time(3) == 0
+    bucket.take(3)
+    assert bucket.wait_time(3) == pytest.approx(1.0)
+    # A cost above the burst waits for a full bucket, then overdraws it
+    clock.advance(1.5)
+    assert bucket.wait_time(10) == 0
+    bucket.take(10)
+    assert bucket.tokens == pytest.approx(-6)
+    assert bucket.wait_time() == pytest.approx(3.5)
+
+def test_bucket_without_rate_never_refills(clock):
+    bucket = TokenBucket(rate=0, burst=1)
+    bucket.take()
+    clock.advance(3600)
+    assert bucket.wait_time() == 60.0
+
+def test_set_limits_caps_saved_tokens(clock):
+    bucket = TokenBucket(rate=10, burst=20)
+    bucket.set_limits(rate=1, burst=2)
+    assert bucket.tokens == 2
+    bucket.take(2)
+    clock.advance(1)
+    assert bucket.wait_time() == 0
+
+def test_evictable_only_when_idle_refilled_and_unused(clock):
+    bucket = TokenBucket(rate=1, burst=10)
+    bucket.take(5)
+    assert not bucket.evictable(clock.now + 4, min_idle=1)
+    assert bucket.evictable(clock.now + 5, min_idle=1)
+    bucket.in_flight = 1
+    assert not bucket.evictable(clock.now + 5, min_idle=1)
+
+def test_unconfigured_tenants_are_limited_per_client(monkeypatch):
+    monkeypatch.delenv("GATEWAY_WORKERS", raising=False)
+    controller = AdmissionController()
+    controller.config["tenant_overrides"] = {"acme": {"rate": 100}}
+    assert controller.tenant_of(make_request({"X-Tenant-Id": "acme"})) == "tenant:acme"
+    # Header values nobody configured can't buy a fresh bucket
+    assert controller.tenant_of(make_request({"X-Tenant-Id": "made-up"})) == "client:10.0.0.1"
+    assert controller.tenant_of(make_request({"X-Api-Key": "secret"}, client=("10.0.0.2", 1))) == "client:10.0.0.2"
+    assert controller.tenant_of(make_request(client=None)) == ANONYMOUS_TENANT
+
+def test_admit_charges_cost_and_sheds_over_the_rate(monkeypatch):
+    monkeypatch.delenv("GATEWAY_WORKERS", raising=False)
+    controller = AdmissionController()
+    controller.config.update(tenant_rate=0.001, tenant_burst=4, tenant_max_concurrency=10)
+
+    async def scenario():
+        request = make_request()
+        async with controller.admit(request, cost=3) as tenant:
+            assert controller.in_flight == 3
+            assert controller.buckets[tenant].in_flight == 3
+        assert controller.in_flight == 0
+        with pytest.raises(HTTPException) as shed:
+            async with controller.admit(request, cost=3):
+                pass
+        return shed.value
+
+    shed = asyncio.run(scenario())
+    assert shed.status_code == 429
+    assert int(shed.headers["Retry-After"]) >= 1
+    assert controller.stats["accepted"] == 1
+    assert controller.stats["shed_rate_limited"] == 1
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+
+from audit_store import AuditStore, decode_cursor, encode_cursor
+
+@pytest.fixture
+def store(tmp_path):
+    store = AuditStore(str(tmp_path / "audit.db"))
+    yield store
+    store.close()
+
+def entry(number: int, timestamp: str, status: str = "GREEN", domain: str = "gdpr", violations=()) -> dict:
+    return {
+        "request_id": f"req_{number}",
+        "timestamp": timestamp,
+        "status": status,
+        "domain": domain,
+        "violations": [{"type": violation} for violation in violations]
+    }
+
+def page_through(store, limit, **filters):
+    seen = []
+    cursor = None
+    while True:
+        page = store.query(limit=limit, cursor=cursor, **filters)
+        seen.extend(e["request_id"] for e in page["entries"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+
+def test_cursor_round_trip():
+    ts = datetime(2026, 1, 2, 3, 4, 5, 678901).timestamp()
+    assert decode_cursor(encode_cursor(ts, 42)) == (ts, 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+def test_paging_across_equal_timestamps(store):
+    # Request numbers come in per-worker blocks, so numbers and times interleave
+    same_second = "2026-03-01T12:00:00"
+    entries = [entry(number, same_second) for number in (5, 101, 3, 102, 4)]
+    entries += [entry(1, "2026-03-01T11:59:59"), entry(201, "2026-03-01T12:00:01")]
+    store.append_batch(entries)
+
+    expected = ["req_201", "req_102", "req_101", "req_5", "req_4", "req_3", "req_1"]
+    for limit in (1, 2, 3, 7, 50):
+        assert page_through(store, limit) == expected
+
+def test_paging_with_filters(store):
+    ts = "2026-03-01T12:00:00"
+    store.append_batch([
+        entry(number, ts, status="RED" if number % 2 else "GREEN",
+              violations=["GDPR_NoConsent"] if number % 3 == 0 else ())
+        for number in range(1, 13)
+    ])
+    assert page_through(store, 2, status="RED") == [f"req_{n}" for n in (11, 9, 7, 5, 3, 1)]
+    assert page_through(store, 2, violation_type="GDPR_NoConsent") == [f"req_{n}" for n in (12, 9, 6, 3)]
+    assert page_through(store, 5, domain="hipaa") == []
+
+def test_retried_batch_is_not_counted_twice(store):
+    batch = [entry(1, "2026-03-01T12:00:00", status="RED", violations=["GDPR_NoConsent"]),
+             entry(2, "2026-03-01T12:00:01")]
+    store.append_batch(batch)
+    store.append_batch(batch + [entry(3, "2026-03-01T12:00:02")])
+    counters = store.counters()
+    assert counters["total"] == 3
+    assert counters["status:RED"] == 1
+    assert counters["violation:GDPR_NoConsent"] == 1
+    assert page_through(store, 10) == ["req_3", "req_2", "req_1"]
+
+def test_allocated_id_blocks_never_overlap(tmp_path):
+    path = str(tmp_path / "audit.db")
+    first, second = AuditStore(path), AuditStore(path)
+    try:
+        blocks = [first.allocate_ids(100), second.allocate_ids(100), first.allocate_ids(50)]
+    finally:
+        first.close()
+        second.close()
+    numbers = [number for block in blocks for number in block]
+    assert len(numbers) == len(set(numbers)) == 250
+    # Numbers are never reissued after a restart
+    reopened = AuditStore(path)
+    try:
+        assert reopened.allocate_ids(1)[0] == max(numbers) + 1
+    finally:
+        reopened.close()
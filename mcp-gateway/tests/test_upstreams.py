@@ -0,0 +1,71 @@
+import math
+from collections import Counter
+
+import pytest
+
+from upstreams import HashRing, Replica, UpstreamClients
+
+URLS = [f"http://backend-{index}:8000" for index in range(4)]
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    monkeypatch.setenv("GATEWAY_HASH_LOAD_FACTOR", "1.25")
+    return UpstreamClients({"backend": URLS})
+
+def keys(count: int):
+    return [f"document-{index}" for index in range(count)]
+
+def test_ring_walk_visits_every_replica_once():
+    ring = HashRing([Replica(url) for url in URLS])
+    walked = [replica.url for replica in ring.walk("some key")]
+    assert sorted(walked) == sorted(URLS)
+    assert list(HashRing([]).walk("some key")) == []
+
+def test_ring_spreads_keys_and_keeps_them_when_a_replica_is_added():
+    replicas = [Replica(url) for url in URLS]
+    ring = HashRing(replicas)
+    owners = {key: next(ring.walk(key)).url for key in keys(4000)}
+    counts = Counter(owners.values())
+    assert set(counts) == set(URLS)
+    assert max(counts.values()) < 2 * min(counts.values())
+
+    grown = HashRing(replicas + [Replica("http://backend-4:8000")])
+    moved = [key for key, url in owners.items() if next(grown.walk(key)).url != url]
+    # Only keys taken over by the new replica move
+    assert all(next(grown.walk(key)).url == "http://backend-4:8000" for key in moved)
+    assert len(moved) < len(owners) / 2
+
+def test_same_key_same_replica_when_idle(upstreams):
+    first = upstreams.choose_by_key("backend", "document-1")
+    assert all(upstreams.choose_by_key("backend", "document-1") is first for _ in range(10))
+    assert upstreams.hash_spillovers == 0
+
+def test_load_stays_bounded_for_a_hot_key(upstreams):
+    replicas = upstreams.replicas["backend"]
+    # Every request has the same key and none completes
+    for _ in range(40):
+        upstreams.choose_by_key("backend", "hot document").in_flight += 1
+    loads = [replica.in_flight for replica in replicas]
+    assert sum(loads) == 40
+    # No replica above load_factor x the average (rounded up)
+    assert max(loads) <= 13
+    assert upstreams.hash_spillovers > 0
+
+def test_load_stays_bounded_under_random_keys(upstreams):
+    replicas = upstreams.replicas["backend"]
+    for total, key in enumerate(keys(400), start=1):
+        upstreams.choose_by_key("backend", key).in_flight += 1
+        assert max(replica.in_flight for replica in replicas) <= math.ceil(1.25 * total / len(replicas))
+
+def test_unhealthy_and_excluded_replicas_are_skipped(upstreams):
+    replicas = upstreams.replicas["backend"]
+    owner = upstreams.choose_by_key("backend", "document-7")
+    owner.healthy = False
+    fallback = upstreams.choose_by_key("backend", "document-7")
+    assert fallback is not owner
+    assert upstreams.choose_by_key("backend", "document-7", exclude=fallback) not in (owner, fallback)
+
+    # With every replica down, still pick one rather than fail
+    for replica in replicas:
+        replica.healthy = False
+    assert upstreams.choose_by_key("backend", "document-7") in replicas
@@ -0,0 +1,326 @@
+import asyncio
+import bisect
+import hashlib
+import math
+import os
+import random
+import time
+import httpx
+from typing import Dict, List, Optional
+
+# Responses that mean the backend never handled the request. 504 is left out: a proxy can
+# time out after the backend already did the work (and /analyze appends to history).
+RETRYABLE_STATUS_CODES = {502, 503}
+# Failures before the request was sent, so a retry can't run it twice
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Remaining time budget forwarded to backends, in milliseconds
+DEADLINE_HEADER = "x-deadline-ms"
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before an upstream could answer"""
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (httpx needs the h2 package for HTTP/2)
+        return True
+    except ImportError:
+        return False
+
+class Replica:
+    """One upstream instance with its own pooled client and load/health state"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client: Optional[httpx.AsyncClient] = None
+        self.healthy = True
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.pool_timeouts = 0
+        self.latency_ewma_ms = 0.0
+        self.last_health_check = None
+
+    def observe_latency(self, latency_ms: float, alpha: float = 0.2):
+        if self.latency_ewma_ms == 0.0:
+            self.latency_ewma_ms = latency_ms
+        else:
+            self.latency_ewma_ms = alpha * latency_ms + (1 - alpha) * self.latency_ewma_ms
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes over one upstream's replicas"""
+
+    def __init__(self, replicas: List[Replica], virtual_nodes: int = 100):
+        points = sorted(
+            (ring_hash(f"{replica.url}#{vnode}"), index)
+            for index, replica in enumerate(replicas)
+            for vnode in range(virtual_nodes)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [index for _, index in points]
+        self.replicas = replicas
+
+    def walk(self, key: str):
+        """Distinct replicas in ring order starting at the key's position"""
+        if not self.hashes:
+            return
+        start = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        seen = set()
+        for offset in range(len(self.hashes)):
+            index = self.owners[(start + offset) % len(self.hashes)]
+            if index not in seen:
+                seen.add(index)
+                yield self.replicas[index]
+                if len(seen) == len(self.replicas):
+                    return
+
+class UpstreamClients:
+    """Long-lived pooled clients for every replica of every upstream service"""
+
+    def __init__(self, routes: Dict[str, List[str]]):
+        self.routes = routes
+        self.limits = httpx.Limits(
+            max_connections=int(os.getenv("GATEWAY_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("GATEWAY_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("GATEWAY_KEEPALIVE_EXPIRY", "30"))
+        )
+        self.timeout = httpx.Timeout(
+            connect=float(os.getenv("GATEWAY_CONNECT_TIMEOUT", "2.0")),
+            read=float(os.getenv("GATEWAY_READ_TIMEOUT", "30.0")),
+            write=float(os.getenv("GATEWAY_WRITE_TIMEOUT", "10.0")),
+            pool=float(os.getenv("GATEWAY_POOL_TIMEOUT", "5.0"))
+        )
+        self.http2 = os.getenv("GATEWAY_HTTP2", "false").lower() == "true" and http2_available()
+        self.health_interval = float(os.getenv("GATEWAY_HEALTH_INTERVAL", "5.0"))
+        self.replicas: Dict[str, List[Replica]] = {
+            name: [Replica(url) for url in urls] for name, urls in routes.items()
+        }
+        self.retries = 0
+        self.deadline_cancellations = 0
+        self.health_task = None
+        
+        # Optional cache-locality routing: same content -> same replica, with bounded load
+        self.routing = os.getenv("GATEWAY_ROUTING", "p2c").lower()
+        self.load_factor = float(os.getenv("GATEWAY_HASH_LOAD_FACTOR", "1.25"))
+        self.rings = {name: HashRing(replicas) for name, replicas in self.replicas.items()}
+        self.hash_routed = 0
+        self.hash_spillovers = 0
+
+    async def start(self):
+        for replicas in self.replicas.values():
+            for replica in replicas:
+                replica.client = self._create_client(replica.url)
+        self.health_task = asyncio.create_task(self._health_loop())
+
+    def _create_client(self, url: str) -> httpx.AsyncClient:
+        if url.startswith("unix://"):
+            # unix:///run/caepa/gdpr.sock -> pooled transport over a co-located backend's socket
+            transport = httpx.AsyncHTTPTransport(uds=url[len("unix://"):], limits=self.limits, http2=self.http2)
+            return httpx.AsyncClient(base_url="http://localhost", transport=transport, timeout=self.timeout)
+        return httpx.AsyncClient(base_url=url, limits=self.limits, timeout=self.timeout, http2=self.http2)
+
+    async def close(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            try:
+                await self.health_task
+            except asyncio.CancelledError:
+                pass
+            self.health_task = None
+        for replicas in self.replicas.values():
+            for replica in replicas:
+                if replica.client is not None:
+                    await replica.client.aclose()
+                    replica.client = None
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(
+                self._probe(replica)
+                for replicas in self.replicas.values()
+                for replica in replicas
+            ))
+            await asyncio.sleep(self.health_interval)
+
+    async def _probe(self, replica: Replica):
+        try:
+            response = await replica.client.get("/health", timeout=min(2.0, self.health_interval))
+            replica.healthy = response.status_code == 200
+        except httpx.HTTPError:
+            replica.healthy = False
+        replica.last_health_check = int(time.time())
+
+    def choose(self, name: str, exclude: Optional[Replica] = None) -> Optional[Replica]:
+        """Power-of-two-choices over healthy replicas, by in-flight requests then latency"""
+        candidates = [r for r in self.replicas[name] if r is not exclude]
+        healthy = [r for r in candidates if r.healthy]
+        # If every replica looks down, still try one rather than failing outright
+        candidates = healthy or candidates
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return min(first, second, key=lambda r: (r.in_flight, r.latency_ewma_ms))
+
+    def choose_by_key(self, name: str, key: str, exclude: Optional[Replica] = None) -> Optional[Replica]:
+        """Consistent hashing with bounded loads: first replica on the ring under its load cap"""
+        replicas = self.replicas[name]
+        healthy = [r for r in replicas if r.healthy and r is not exclude]
+        if not healthy:
+            return self.choose(name, exclude=exclude)
+        
+        # No replica may take more than load_factor times the average in-flight load
+        total_in_flight = sum(r.in_flight for r in healthy) + 1
+        capacity = math.ceil(self.load_factor * total_in_flight / len(healthy))
+        
+        for position, replica in enumerate(self.rings[name].walk(key)):
+            if replica is exclude or not replica.healthy:
+                continue
+            if replica.in_flight < capacity:
+                if position > 0:
+                    self.hash_spillovers += 1
+                self.hash_routed += 1
+                return replica
+        return self.choose(name, exclude=exclude)
+
+    async def post(self, name: str, path: str, retry: bool = True, routing_key: Optional[str] = None,
+                   deadline: Optional[float] = None, **kwargs) -> httpx.Response:
+        """POST to a replica, retrying once on a different replica if the first never got the request.
+
+        Errors after the request may have reached the backend (read timeouts, dropped
+        connections) are not retried, since the backend may already have done the work.
+
+        deadline is a time.monotonic() expiry; the remaining budget bounds every attempt
+        and is forwarded to the backend so it can stop work nobody will wait for.
+        """
+        use_hash = routing_key is not None and self.routing == "hash"
+        replica = self.choose_by_key(name, routing_key) if use_hash else self.choose(name)
+        try:
+            response = await self._send(replica, path, deadline, **kwargs)
+            if not retry or response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+        except RETRYABLE_ERRORS:
+            if not retry:
+                raise
+            response = None
+
+        # A retry that cannot finish in time only adds load
+        if deadline is not None and deadline <= time.monotonic():
+            if response is not None:
+                return response
+            self.deadline_cancellations += 1
+            raise DeadlineExceeded(f"Deadline exceeded calling {name}")
+
+        fallback = self.choose_by_key(name, routing_key, exclude=replica) if use_hash else self.choose(name, exclude=replica)
+        if fallback is None:
+            if response is not None:
+                return response
+            raise httpx.ConnectError(f"No replica of {name} available")
+        self.retries += 1
+        return await self._send(fallback, path, deadline, **kwargs)
+
+    def replica_at(self, name: str, url: str) -> Optional[Replica]:
+        """The replica of an upstream with this URL (as reported by endpoint_of)"""
+        return next((r for r in self.replicas[name] if r.url == url), None)
+
+    async def get(self, replica: Replica, path: str, deadline: Optional[float] = None, **kwargs) -> httpx.Response:
+        """GET from one specific replica. Not retried elsewhere: lookups by analysis id only
+        succeed on the replica whose history stored it."""
+        return await self._send(replica, path, deadline, method="GET", **kwargs)
+
+    async def _send(self, replica: Replica, path: str, deadline: Optional[float] = None,
+                    method: str = "POST", **kwargs) -> httpx.Response:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.deadline_cancellations += 1
+                raise DeadlineExceeded(f"Deadline exceeded before calling {replica.url}")
+            kwargs["headers"] = {**kwargs.get("headers", {}), DEADLINE_HEADER: str(int(remaining * 1000))}
+            kwargs["timeout"] = httpx.Timeout(
+                connect=min(self.timeout.connect, remaining),
+                read=min(self.timeout.read, remaining),
+                write=min(self.timeout.write, remaining),
+                pool=min(self.timeout.pool, remaining)
+            )
+        
+        replica.requests += 1
+        replica.in_flight += 1
+        replica.peak_in_flight = max(replica.peak_in_flight, replica.in_flight)
+        start_time = time.time()
+        try:
+            response = await replica.client.request(method, path, **kwargs)
+            replica.observe_latency((time.time() - start_time) * 1000)
+            if response.status_code < 500:
+                replica.healthy = True
+            response.extensions["upstream_url"] = replica.url
+            return response
+        except httpx.PoolTimeout:
+            replica.pool_timeouts += 1
+            replica.errors += 1
+            raise
+        except httpx.TimeoutException:
+            if deadline is not None and deadline <= time.monotonic():
+                # Our budget ran out, which says nothing about the replica's health
+                self.deadline_cancellations += 1
+                raise DeadlineExceeded(f"Deadline exceeded waiting for {replica.url}")
+            replica.errors += 1
+            replica.healthy = False
+            raise
+        except httpx.RequestError:
+            replica.errors += 1
+            # Take it out of rotation until a health probe or request succeeds again
+            replica.healthy = False
+            raise
+        finally:
+            replica.in_flight -= 1
+
+    def load(self, name: str):
+        """(total in-flight, mean latency EWMA of healthy replicas) for admission decisions"""
+        replicas = self.replicas[name]
+        healthy = [r for r in replicas if r.healthy] or replicas
+        in_flight = sum(r.in_flight for r in replicas)
+        latency = sum(r.latency_ewma_ms for r in healthy) / len(healthy) if healthy else 0.0
+        return in_flight, latency
+
+    def get_stats(self) -> Dict:
+        max_connections = self.limits.max_connections
+        return {
+            "http2": self.http2,
+            "max_connections": max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "retries": self.retries,
+            "deadline_cancellations": self.deadline_cancellations,
+            "routing": self.routing,
+            "hash_routed": self.hash_routed,
+            "hash_spillovers": self.hash_spillovers,
+            "upstreams": {
+                name: [
+                    {
+                        "url": r.url,
+                        "healthy": r.healthy,
+                        "in_flight": r.in_flight,
+                        "peak_in_flight": r.peak_in_flight,
+                        "requests": r.requests,
+                        "errors": r.errors,
+                        "pool_timeouts": r.pool_timeouts,
+                        "latency_ewma_ms": round(r.latency_ewma_ms, 2),
+                        "pool_saturation": round(r.in_flight / max_connections, 3) if max_connections else 0.0,
+                        "last_health_check": r.last_health_check
+                    }
+                    for r in replicas
+                ]
+                for name, replicas in self.replicas.items()
+            }
+        }
+
+def endpoint_of(response: httpx.Response) -> str:
+    """URL of the replica that produced a response (including unix:// replicas)"""
+    if "upstream_url" in response.extensions:
+        return response.extensions["upstream_url"]
+    url = response.request.url
+    return f"{url.scheme}://{url.netloc.decode()}"